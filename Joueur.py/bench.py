@@ -0,0 +1,85 @@
+# Searches a few positions to a fixed depth with the Chess AI, to compare
+# search settings and process counts by time to depth, nodes, speed and
+# transposition table hit rate.
+
+import argparse
+from timeit import default_timer
+
+from games.chess.ai import AI
+
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("italian", "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 0 5"),
+    ("queen's gambit", "r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R1BQ1RK1 w - - 0 8"),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+]
+
+
+def search(fen, depth, settings):
+    # a fresh AI for each position, so no table is warm from the last one
+    ai = AI(None)
+    ai.set_settings(settings)
+    ai.init_search()
+    ai.depth_limit = depth
+    ai.chess = ai.backend(fen, ai.debug)
+
+    # as long as it takes to reach the depth
+    ai.time_manager.start_turn(10 ** 18, ai.chess.move_number, 1)
+
+    start_time = default_timer()
+    move = ai.iterative_deepening(ai.chess)
+    duration = default_timer() - start_time
+    ai.end(False, "")
+
+    return ai, ai.format_moves([move]), duration
+
+
+def run(positions, depth, settings, mode, count):
+    # mode is "processes" to split the root moves, or "threads" for Lazy SMP
+    total_nodes = 0
+    total_time = 0
+    total_probes = 0
+    total_hits = 0
+
+    print("{} {}:".format(count, mode))
+
+    for name, fen in positions:
+        ai, move, duration = search(fen, depth, "&".join(
+            filter(None, (settings, "{}={}".format(mode, count)))))
+        nodes = ai.nodes + ai.qnodes
+        total_nodes += nodes
+        total_time += duration
+        total_probes += ai.tt.probes
+        total_hits += ai.tt.hits
+
+        print("  {:<16} depth {} {:>6} {:>9} nodes {:>8.2f}s {:>7.0f} nps {:>5.1f}% TT hits".format(
+            name, ai.depth, move, nodes, duration, nodes / max(duration, 1e-9),
+            ai.tt.hits * 100 / max(ai.tt.probes, 1)))
+
+    print("  {} nodes in {:.2f}s ({:.0f} nps, {:.1f}% TT hits)".format(
+        total_nodes, total_time, total_nodes / max(total_time, 1e-9),
+        total_hits * 100 / max(total_probes, 1)))
+
+    return total_time, total_nodes / max(total_time, 1e-9)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Searches positions to a fixed depth and reports the time it took, to compare search settings and process counts.')
+    parser.add_argument('fen', action='store', nargs='?', help='the position to search (a built-in set by default)')
+    parser.add_argument('-d', '--depth', action='store', dest='depth', type=int, default=5, help='the depth to search each position to')
+    parser.add_argument('-s', '--settings', action='store', dest='settings', default='', help='AI settings, in the same form as --aiSettings')
+    parser.add_argument('-p', '--processes', action='store', dest='processes', type=int, nargs='+', default=[1], help='numbers of processes to split the root moves over, each compared to the first')
+    parser.add_argument('-t', '--threads', action='store', dest='threads', type=int, nargs='+', help='numbers of processes to search with Lazy SMP instead, each compared to the first')
+    args = parser.parse_args()
+
+    positions = [("position", args.fen)] if args.fen else POSITIONS
+    mode, counts = ("threads", args.threads) if args.threads else ("processes", args.processes)
+    results = [run(positions, args.depth, args.settings, mode, count) for count in counts]
+
+    if len(results) > 1:
+        print()
+        for count, (duration, nps) in zip(counts, results):
+            print("{:>3} {:<10} {:.2f}s to depth {}, {:.2f}x speedup, {:.0f} nps".format(
+                count, mode + ":", duration, args.depth, results[0][0] / max(duration, 1e-9), nps))
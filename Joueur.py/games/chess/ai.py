@@ -1,15 +1,38 @@
 # This is where you build your AI for the Chess game.
 
+import json
+from array import array
+from math import log
+from multiprocessing import Event, Pool
+from threading import Thread
 from timeit import default_timer
 
 # local imports
 from joueur.base_ai import BaseAI
 from games.chess.engine import Chess
+from games.chess.bitboard import BitboardChess
+from games.chess.book import OpeningBook
+from games.chess.tablebase import Tablebases, DRAW
+from games.chess.transposition import TranspositionTable, LOWER, UPPER, EXACT
+from games.chess.movepicker import MoveOrdering, pick_moves, capture_order, losing_capture, CODE_VALUES
+from games.chess.timemanager import TimeManager, game_phase
+from games.chess.constants import *
 
 # <<-- Creer-Merge: imports -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
 # you can add additional import(s) here
 # <<-- /Creer-Merge: imports -->>
 
+# late move reductions in plies by depth left and number of moves searched,
+# growing with the log of both
+LMR_MOVES = 64
+LMR_TABLE = [int(0.5 + log(depth) * log(moves) / 2) if depth and moves else 0
+             for depth in range(MAX_PLY) for moves in range(LMR_MOVES)]
+
+
+class SearchTimeout(Exception):
+    """ Raised inside the search once the deadline for the move has passed. """
+
+
 class AI(BaseAI):
     """ The basic AI functions that are the same between games. """
 
@@ -28,14 +51,8 @@ class AI(BaseAI):
         """
         # <<-- Creer-Merge: start -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
         
-        # our local board representation
-        self.chess = Chess(self.game.fen)
-
-        # represents whether or not we want minimax to return high or low
-        self.color_code = 1 if self.player.color == "White" else -1
-
-        # depth limit (default to 3 if no depth provided)
-        self.depth_limit = int(self.get_setting("depth_limit") or 3)
+        self.init_search()
+        self.chess = self.backend(self.game.fen, self.debug)
 
         # <<-- /Creer-Merge: start -->>
 
@@ -54,7 +71,27 @@ class AI(BaseAI):
             reason (str): The human readable string explaining why you won or lost.
         """
         # <<-- Creer-Merge: end -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
-        # replace with your end logic
+        if self.ponder_thread is not None:
+            self.stop_pondering()
+
+        if self.ponder:
+            print("Pondering: {}/{} hits ({:.1f}%), {:.2f}s saved".format(
+                self.ponder_hits, self.ponders, self.ponder_hits * 100 / max(self.ponders, 1),
+                self.ponder_saved))
+
+        if self.pool is not None:
+            self.pool.terminate()
+
+        if self.book is not None:
+            self.book.close()
+
+        if self.tablebases is not None:
+            self.tablebases.close()
+
+        if self.stats_file is not None:
+            self.stats_file.close()
+
+        self.tt.close()
         # <<-- /Creer-Merge: end -->>
     def run_turn(self):
         """ This is called every time it is this AI.player's turn.
@@ -67,18 +104,78 @@ class AI(BaseAI):
         if len(self.game.moves) > 0:
             self.update_last_move()
 
-        move = self.minimax_root(self.depth_limit, self.chess, True)
+        self.time_manager.start_turn(self.player.time_remaining, self.chess.move_number,
+                                     game_phase(self.chess))
+
+        # a search of the move the opponent just made is still running if
+        # they played the one we expected, and known openings are played
+        # from the book without searching
+        book_move = 0
+        tablebase_move = 0
+
+        if self.ponder_thread is not None:
+            move = self.finish_pondering()
+        else:
+            self.ponder_time = 0
+            book_move = self.book_move()
+            # and endings in the tablebases are looked up
+            tablebase_move = 0 if book_move else self.tablebase_move(self.chess)
+            move = book_move or tablebase_move or self.iterative_deepening(self.chess)
+
+        duration = self.time_manager.elapsed()
         self.chess.move(move)
+        played = move
+
+        # a ponder hit saves whatever part of a usual move's time (the soft
+        # budget) it didn't take, up to the time spent pondering
+        if self.ponder_time:
+            self.ponder_saved += max(min(self.ponder_time, self.time_manager.soft - duration), 0)
+
+        # the search works on packed moves, so get a readable view of ours
+        move = self.chess.get_move(move)
         
-        print("Best move: {}".format(move))
+        if book_move:
+            print("Book move: {}".format(move))
+            print("Time: {:.0f}us".format(duration * 1000000))
+        elif tablebase_move:
+            print("Tablebase move: {}".format(move))
+            print("Score: {}, Time: {:.0f}us".format(self.format_score(self.score), duration * 1000000))
+        else:
+            print("Best move: {}".format(move))
+            print("Depth: {} ({} selective), Score: {}, PV: {}".format(
+                self.depth, self.seldepth, self.format_score(self.score), self.format_moves(self.pv)))
+            print("Nodes: {} ({} quiescence, {:.0f} nps)".format(
+                self.nodes + self.qnodes, self.qnodes,
+                (self.nodes + self.qnodes) / max(duration + self.ponder_time, 1e-9)))
+            print("Time: {:.2f}s (soft {:.2f}s, hard {:.2f}s, rtt {:.0f}ms)".format(
+                duration, self.time_manager.soft * self.time_manager.scale,
+                self.time_manager.hard, self.time_manager.rtt * 1000))
+            print("Cutoffs: {} ({:.1f}% by the first move)".format(
+                self.cutoffs, self.first_cutoffs * 100 / max(self.cutoffs, 1)))
+            print("Pruned: {}".format(", ".join(
+                "{} {}".format(count, kind) for kind, count in self.pruned.items())))
+            print("TT: {} probes, {} hits ({:.1f}%), {} collisions, {}/1000 full".format(
+                self.tt.probes, self.tt.hits, self.tt.hits * 100 / max(self.tt.probes, 1),
+                self.tt.collisions, self.tt.hashfull()))
+            if self.tablebases is not None:
+                print("Tablebase hits: {}".format(self.tb_hits))
+        if self.ponder:
+            print("Ponder: {} ({}/{} hits, {:.2f}s saved)".format(
+                "hit after {:.2f}s".format(self.ponder_time) if self.ponder_time else "no hit",
+                self.ponder_hits, self.ponders, self.ponder_saved))
         self.chess.print()
         print()
         
-        promotion = '' if not move.promotion else Chess.PIECE_MAP[self.chess.board[move.m_to].type]
+        promotion = '' if not move.promotion else Chess.PIECE_MAP[move.promotion]
 
         for piece in self.player.pieces:
-            if ''.join((piece.file, str(piece.rank))) == Chess.get_san(move.m_from):
-                piece.move(*tuple(Chess.get_san(move.m_to)), promotionType=promotion)
+            if ''.join((piece.file, str(piece.rank))) == self.chess.get_san(move.m_from):
+                piece.move(*tuple(self.chess.get_san(move.m_to)), promotionType=promotion)
+
+        self.time_manager.end_turn()
+
+        if self.ponder:
+            self.start_pondering(played)
 
         return True  # to signify we are done with our turn.
 
@@ -86,74 +183,881 @@ class AI(BaseAI):
 
     # <<-- Creer-Merge: functions -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
 
+    def init_search(self, tt=None):
+        # everything the search needs that doesn't depend on the game, so
+        # pool workers can set up the same search without one (and with
+        # the shared transposition table, for Lazy SMP)
+
+        # our local board representation ("0x88" by default, or "bitboard"),
+        # optionally checking its incremental state as it goes
+        self.backend = BitboardChess if self.get_setting("backend") == "bitboard" else Chess
+        self.debug = self.get_flag("debug", False)
+        # depth limit (default to as deep as time allows if no depth provided)
+        self.depth_limit = min(int(self.get_setting("depth_limit") or MAX_PLY), MAX_PLY - 1)
+
+        # how many plies of captures to resolve past the horizon (no limit
+        # if no depth provided)
+        self.qsearch_depth = int(self.get_setting("qsearch_depth") or MAX_PLY)
+
+        # endgame tablebases made by maketb.py (none if no directory
+        # provided), looked up at the root and in the tree
+        tablebases = self.get_setting("tablebases")
+        self.tablebases = Tablebases(tablebases) if tablebases else None
+
+        # forward pruning, each of which can be turned off or tuned (margins
+        # are per ply of depth left, in the units of the evaluation)
+        self.null_move = self.get_flag("null_move")
+        self.null_move_reduction = int(self.get_setting("null_move_reduction") or 2)
+        self.null_move_verify = int(self.get_setting("null_move_verify") or PIECE_VALUES[ROOK])
+        self.reverse_futility = self.get_flag("reverse_futility")
+        self.reverse_futility_depth = int(self.get_setting("reverse_futility_depth") or 3)
+        self.reverse_futility_margin = float(self.get_setting("reverse_futility_margin") or 15)
+        self.futility = self.get_flag("futility")
+        self.futility_depth = int(self.get_setting("futility_depth") or 2)
+        self.futility_margin = float(self.get_setting("futility_margin") or 20)
+        self.razoring = self.get_flag("razoring")
+        self.razoring_depth = int(self.get_setting("razoring_depth") or 2)
+        self.razoring_margin = float(self.get_setting("razoring_margin") or 30)
+
+        # late move reductions for quiet moves after the first few, from a
+        # minimum depth left, and extensions for checks and recaptures
+        self.lmr = self.get_flag("lmr")
+        self.lmr_moves = int(self.get_setting("lmr_moves") or 3)
+        self.lmr_depth = int(self.get_setting("lmr_depth") or 3)
+        self.extensions = self.get_flag("extensions")
+
+        # processes searching the same root side by side, sharing the
+        # transposition table (default to searching alone if no count
+        # provided), for Lazy SMP
+        self.threads = max(int(self.get_setting("threads") or 1), 1)
+
+        # transposition table (default to 16 MB if no size provided), in
+        # shared memory if there are other processes to share it with
+        if tt is None:
+            tt = TranspositionTable(int(self.get_setting("hash_mb") or 16), shared=self.threads > 1)
+        self.tt = tt
+
+        # soft and hard time budgets per move, with knobs for the policy
+        self.time_manager = TimeManager(
+            reserve_ms=float(self.get_setting("time_reserve_ms") or 500),
+            rtt_factor=float(self.get_setting("time_rtt_factor") or 3),
+            moves_to_go_min=float(self.get_setting("time_moves_to_go_min") or 20),
+            moves_to_go_max=float(self.get_setting("time_moves_to_go_max") or 45),
+            hard_ratio=float(self.get_setting("time_hard_ratio") or 4),
+            max_share=float(self.get_setting("time_max_share") or 0.2),
+            instability=float(self.get_setting("time_instability") or 0.5))
+
+        # killer, history and countermove tables for ordering quiet moves
+        self.ordering = MoveOrdering()
+
+        # triangular table of principal variations: row n holds the best
+        # line found from ply n, in its entries n up to pv_length[n]
+        self.pv_table = array('L', [0]) * (MAX_PLY * MAX_PLY)
+        self.pv_length = array('B', [0]) * (MAX_PLY + 1)
+
+        # nodes visited (and how many of them in quiescence), beta cutoffs
+        # (and how many of them by the first move tried), nodes cut short by
+        # each kind of pruning, tablebase hits, depth reached (and the
+        # deepest ply any line got to), score and principal variation of
+        # the last search
+        self.nodes = 0
+        self.qnodes = 0
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.pruned = dict.fromkeys(PRUNING_KINDS, 0)
+        self.tb_hits = 0
+        self.depth = 0
+        self.seldepth = 0
+        self.score = 0
+        self.pv = []
+
+        # file to append a JSON line of statistics to after each iteration
+        # of the search (none if no path provided), for tuning
+        stats_file = self.get_setting("stats_file")
+        self.stats_file = open(stats_file, "a") if stats_file else None
+
+        # or processes to split the root moves over (default to searching
+        # alone if no count provided), each with a search of its own, if
+        # not searching with Lazy SMP
+        self.processes = max(int(self.get_setting("processes") or 1), 1)
+        workers = self.threads - 1 if self.threads > 1 else self.processes
+        self.pool = None
+        self.stop = None
+
+        if workers > 1 or self.threads > 1:
+            # workers check the stop event along with the deadline, so the
+            # ones still searching can be called off early
+            self.stop = Event()
+            settings = dict(self._settings, processes="1", threads="1", book="", stats_file="")
+            self.pool = Pool(workers, _init_worker, (
+                "&".join("{}={}".format(*item) for item in settings.items()), self.stop, self.tt.name))
+
+        # Polyglot opening book (none if no path provided), how many moves
+        # into the game to keep playing from it (default to 20 if no depth
+        # provided), and whether to play its heaviest move or pick one by
+        # weight ("weighted" by default, or "best")
+        book = self.get_setting("book")
+        self.book = OpeningBook(book) if book else None
+        self.book_depth = int(self.get_setting("book_depth") or 20)
+        self.book_best = self.get_setting("book_select") == "best"
+
+        # whether to search the reply we expect while the opponent thinks
+        # (off by default, since it takes CPU time from whoever shares the
+        # machine), the reply being searched and the thread searching it,
+        # and how often the guess was right and how much of our own time
+        # that saved
+        self.ponder = self.get_flag("ponder", False)
+        self.pondering = False
+        self.ponder_move = 0
+        self.ponder_thread = None
+        self.ponder_start = 0
+        self.ponder_time = 0
+        self.ponder_result = None
+        self.ponders = 0
+        self.ponder_hits = 0
+        self.ponder_saved = 0
+
     def update_last_move(self):
         move = self.game.moves[-1]
         fr_from = move.from_file + str(move.from_rank)
         fr_to = move.to_file + str(move.to_rank)
-        self.chess.move(self.chess.get_enemy_move(fr_from, fr_to))
+        move = self.chess.get_enemy_move(fr_from, fr_to)
 
-    #@profile(immediate=True)
-    def minimax_root(self, depth, game, is_max_player):
+        if self.ponder_thread is not None and move != self.ponder_move:
+            self.stop_pondering()
+
+        self.chess.move(move)
+
+    def book_move(self):
+        # a move from the book while the game is still within its depth, or
+        # 0 if there isn't one
+        if self.book is None or self.chess.move_number > self.book_depth:
+            return 0
+
+        move = self.book.probe(self.chess, self.book_best)
+
+        if move:
+            # there's no search to ponder on
+            self.pv = []
+
+        return move
+
+    def tablebase_move(self, game):
+        # the move the tablebases say mates soonest (or holds out longest),
+        # or 0 if they don't cover every position it could lead to
+        if self.tablebases is None or game.piece_count() > self.tablebases.max_pieces + 1:
+            return 0
+
+        best_move = 0
+        best_score = -INFINITY
+
+        for move in game.generate_moves():
+            game.move(move)
+            value = self.tablebases.probe(game)
+            game.undo()
+
+            if value is None:
+                return 0
+
+            score = -self.tablebase_score(value, 1)
+            if score > best_score:
+                best_score = score
+                best_move = move
+
+        self.score = best_score
+        # there's no search to ponder on
+        self.pv = []
+
+        return best_move
+
+    def tablebase_score(self, value, ply=0):
+        # a table value as a score for the side to move, counting the plies
+        # to mate from ply plies before the position (in the tree they're
+        # left counted from the position, so they can be stored in the
+        # transposition table as they are)
+        if value == DRAW:
+            return DRAW_SCORE
+
+        plies = value - 1
+        return TB_WIN - plies - ply if plies & 1 else -TB_WIN + plies + ply
+
+    def start_pondering(self, played):
+        # search the reply our principal variation expects on a copy of the
+        # board, with no deadline until the opponent's move comes in
+        if len(self.pv) < 2 or self.pv[0] != played:
+            return
+
+        game = self.backend.deserialize(self.chess.serialize(), self.debug)
+        self.ponder_move = self.pv[1]
+        game.move(self.ponder_move)
+
+        self.pondering = True
+        self.deadline = float("inf")
+        self.ponder_start = default_timer()
+        self.ponder_result = None
+        self.ponders += 1
+        self.ponder_thread = Thread(target=self.ponder_search, args=(game,), daemon=True)
+        self.ponder_thread.start()
+
+    def ponder_search(self, game):
+        self.ponder_result = self.iterative_deepening(game)
+
+    def finish_pondering(self):
+        # the opponent played the reply we were searching, so the search
+        # carries on as this turn's, now against the clock the time manager
+        # just started
+        self.ponder_time = default_timer() - self.ponder_start
+        self.ponder_hits += 1
+        self.time_manager.credit = self.ponder_time
+
+        # the pondering counts toward the soft budget, so if it's already
+        # past the point a search of our own would have stopped at, the
+        # last iteration it finished is played at once
+        if self.depth and self.time_manager.soft_exceeded():
+            self.deadline = 0
+        else:
+            self.deadline = self.time_manager.hard_deadline
+
+        self.pondering = False
+        self.ponder_thread.join()
+        self.ponder_thread = None
+
+        # it can only come back empty handed if the reply ended the game
+        if self.ponder_result is None:
+            self.ponder_time = 0
+            return self.iterative_deepening(self.chess)
+
+        return self.ponder_result
+
+    def stop_pondering(self):
+        # the opponent played something else, so drop the search of the
+        # reply we expected (its table entries can still help)
+        self.deadline = 0
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.pondering = False
+
+    def iterative_deepening(self, game, helper=0):
+        # search one ply deeper at a time until the time manager calls it,
+        # always keeping the best move of the last search that finished.
+        # Lazy SMP helpers (numbered from 1) skip some depths so they don't
+        # all search the same one, and search until they're stopped. A
+        # ponder search has its deadline set by whoever started it, and only
+        # goes by the time manager once the reply it's searching is played
+        if not self.pondering:
+            self.deadline = self.time_manager.hard_deadline
+
+        if not helper:
+            self.tt.new_search()
+
+        # counts are per search, the transposition table's included, so
+        # the helpers' are added onto ours for the same search
+        _reset_stats(self)
+        self.depth = 0
+        self.score = 0
+        self.pv = []
+        self.root_ply = game.ply
+        self.ordering.new_search()
+
+        helpers = self.start_helpers(game) if self.threads > 1 and not helper else []
+        best_move = None
+        score = 0
         start_time = default_timer()
+        # nodes searched by each iteration so far, for the branching factor
+        iteration_nodes = [0]
+
+        for depth in range(1, self.depth_limit + 1):
+            if helper and ((depth + SKIP_PHASE[(helper - 1) % len(SKIP_PHASE)]) //
+                           SKIP_SIZE[(helper - 1) % len(SKIP_SIZE)]) % 2:
+                continue
+
+            self.fail_lows = 0
+
+            try:
+                score, move = self.aspiration_search(depth, game, score)
+            except SearchTimeout:
+                # unwind whatever the search had left on the board
+                while game.ply > self.root_ply:
+                    if game.last_move():
+                        game.undo()
+                    else:
+                        game.undo_null()
+
+                break
+
+            # no legal moves
+            if move is None:
+                break
+
+            changed = best_move is not None and move != best_move
+            best_move = move
+            self.depth = depth
+            self.score = score
+            self.pv = self.pv_table[:self.pv_length[0]].tolist()
+
+            if self.stats_file is not None and not helper:
+                self.write_stats(game, start_time, iteration_nodes)
+
+            if (not helper and not self.pondering and
+                    self.time_manager.iteration_done(changed, self.fail_lows)):
+                break
+
+        if helpers:
+            best_move = self.collect_helpers(helpers, best_move)
+
+        # if the first iteration didn't finish, anything legal will have to do
+        if best_move is None:
+            moves = game.generate_moves()
+            best_move = moves[0] if moves else None
+
+        return best_move
+
+    def start_helpers(self, game):
+        # set the Lazy SMP helpers searching the same root as us
+        data = game.serialize()
 
-        moves = game.generate_moves()
-        #random.shuffle(moves)
-        best_value = -9999
+        return [self.pool.apply_async(_lazy_search, ((data, helper, self.depth_limit, self.deadline, self.tt.age),))
+                for helper in range(1, self.threads)]
+
+    def collect_helpers(self, results, best_move):
+        # stop the helpers and take the deepest search that finished, ours
+        # if none went deeper
+        self.stop.set()
+
+        for result in results:
+            depth, score, pv, stats = result.get()
+            self.add_stats(stats)
+
+            if depth > self.depth and pv:
+                self.depth = depth
+                self.score = score
+                self.pv = pv
+                best_move = pv[0]
+
+        self.stop.clear()
+
+        return best_move
+
+    def aspiration_search(self, depth, game, score):
+        if depth == 1:
+            return self.negamax_root(depth, game, -INFINITY, INFINITY)
+
+        # search a narrow window around the last score, widening whichever
+        # side it fails on until the score falls inside
+        delta = ASPIRATION_WINDOW
+        alpha = score - delta
+        beta = score + delta
+
+        while True:
+            value, move = self.negamax_root(depth, game, alpha, beta)
+
+            # the search fails soft, so the new window can start from the
+            # bound it returned rather than the old one
+            if value <= alpha:
+                alpha = max(value - delta, -INFINITY)
+                self.fail_lows += 1
+            elif value >= beta:
+                beta = min(value + delta, INFINITY)
+            else:
+                return value, move
+
+            delta *= 2
+
+    #@profile(immediate=True)
+    def negamax_root(self, depth, game, alpha, beta):
+        self.nodes += 1
+        self.pv_length[0] = 0
+
+        # no more extensions once a line is twice the nominal depth
+        self.extension_limit = depth * 2
+        alpha_orig = alpha
+
+        # start down the principal variation of the last iteration
+        pv_move = self.pv[0] if self.pv else 0
+        self.follow_pv = bool(self.pv)
+
+        if not pv_move:
+            entry = self.tt.probe(game.hash)
+            pv_move = entry[3] if entry else 0
+
+        best_value = -INFINITY
         best_move = None
 
-        for move in moves:
-            duration = (default_timer() - start_time) * 1000000000
+        ordering = self.ordering
+        moves = pick_moves(game, pv_move & MOVE_KEY_MASK, ordering.get_killers(0),
+                           ordering.get_counter(game.last_move()), ordering.history)
+        results = []
 
-            # if turn is taking longer than 5% of reminaing time, return now
-            if ((duration/self.player.time_remaining) * 100) > 5:
+        for move in moves:
+            # once the first move has set a bound, the rest can be split
+            # over the pool (but not while pondering, since the workers are
+            # handed the deadline up front)
+            if (best_move is not None and self.pool is not None and self.threads == 1 and
+                    depth >= SPLIT_DEPTH and not self.pondering):
+                results = self.split_root(depth, game, [move, *moves], alpha, beta)
                 break
 
+            if move != pv_move:
+                self.follow_pv = False
+
             game.move(move)
-            value = self.minimax(depth-1, game, -10000, 10000, not is_max_player)
+
+            # only the first move gets the full window, the rest just have
+            # to prove they're no better and are searched again if not
+            if best_move is None:
+                value = -self.negamax(depth-1, game, -beta, -alpha, 1)
+            else:
+                value = -self.negamax(depth-1, game, -alpha-1, -alpha, 1)
+
+                if alpha < value < beta:
+                    value = -self.negamax(depth-1, game, -beta, -alpha, 1)
+
             game.undo()
 
-            if value >= best_value:
+            if value > best_value or best_move is None:
                 best_value = value
                 best_move = move
 
-        return best_move
+                if value > alpha:
+                    alpha = value
+                    self.update_pv(0, move)
+
+                    if alpha >= beta:
+                        break
+
+        for move, value, pv in results:
+            if value > best_value:
+                best_value = value
+                best_move = move
+
+                if value > alpha:
+                    alpha = value
+                    self.pv_table[0] = move
+                    self.pv_table[1:len(pv) + 1] = array('L', pv)
+                    self.pv_length[0] = len(pv) + 1
 
-    def minimax(self, depth, game, alpha, beta, is_max_player):
-        if game.in_draw():
-            return -999
+                    if alpha >= beta:
+                        break
 
+        if best_move:
+            if best_value <= alpha_orig:
+                bound = UPPER
+            elif best_value >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+
+            self.tt.store(game.hash, depth, bound, best_value, best_move)
+
+        return best_value, best_move
+
+    def split_root(self, depth, game, moves, alpha, beta):
+        # search root moves in the pool against the bound the first move
+        # set, returning the move, score and PV of each that finished
+        data = game.serialize()
+        tasks = [(data, move, depth, alpha, beta, self.deadline) for move in moves]
+        results = []
+        timed_out = False
+
+        for move, value, pv, stats in self.pool.imap_unordered(_search_move, tasks):
+            self.add_stats(stats)
+
+            if value is None:
+                timed_out = True
+            else:
+                results.append((move, value, pv))
+
+                # a move that fails high settles the root, so the workers
+                # still on the others can stop
+                if value >= beta:
+                    self.stop.set()
+
+        self.stop.clear()
+
+        # workers only stop early for the deadline or a fail high
+        if timed_out and not any(value >= beta for _, value, _ in results):
+            raise SearchTimeout()
+
+        return results
+
+    def write_stats(self, game, start_time, iteration_nodes):
+        # a JSON line of this search's counts so far after an iteration
+        # finishes, the transposition table's included (Lazy SMP helpers'
+        # are only added in once the whole search is over)
+        duration = default_timer() - start_time
+        nodes = self.nodes + self.qnodes
+        iteration_nodes.append(nodes - sum(iteration_nodes))
+
+        self.stats_file.write(json.dumps({
+            "fen": game.generate_fen(),
+            "ponder": self.pondering,
+            "depth": self.depth,
+            "seldepth": self.seldepth,
+            "score": self.score,
+            "score_text": self.format_score(self.score),
+            "time": round(duration, 6),
+            "nodes": nodes,
+            "qnodes": self.qnodes,
+            "nps": round(nodes / max(duration, 1e-9)),
+            # how many times more nodes this iteration took than the last
+            "ebf": round(iteration_nodes[-1] / iteration_nodes[-2], 3) if iteration_nodes[-2] else None,
+            "tt_probes": self.tt.probes,
+            "tt_hits": self.tt.hits,
+            "tt_collisions": self.tt.collisions,
+            "cutoffs": self.cutoffs,
+            "first_cutoff_rate": round(self.first_cutoffs / max(self.cutoffs, 1), 4),
+            "pruned": self.pruned,
+            "tb_hits": self.tb_hits,
+            "pv": self.format_moves(self.pv).split(),
+        }) + "\n")
+        self.stats_file.flush()
+
+    def get_stats(self):
+        # counts from a worker's search, to add to the main process's
+        return (self.nodes, self.qnodes, self.cutoffs, self.first_cutoffs, self.pruned,
+                self.tb_hits, self.seldepth, self.tt.probes, self.tt.hits, self.tt.collisions)
+
+    def add_stats(self, stats):
+        nodes, qnodes, cutoffs, first_cutoffs, pruned, tb_hits, seldepth, probes, hits, collisions = stats
+        self.seldepth = max(self.seldepth, seldepth)
+        self.nodes += nodes
+        self.qnodes += qnodes
+        self.cutoffs += cutoffs
+        self.first_cutoffs += first_cutoffs
+        self.tb_hits += tb_hits
+        self.tt.probes += probes
+        self.tt.hits += hits
+        self.tt.collisions += collisions
+
+        for kind, count in pruned.items():
+            self.pruned[kind] += count
+
+    def negamax(self, depth, game, alpha, beta, ply, null_ok=True):
         if not depth:
-            return game.get_value() * self.color_code
+            return self.quiescence(game, alpha, beta, ply, 0)
+
+        self.nodes += 1
+        self.pv_length[ply] = ply
+
+        if not self.nodes & (NODES_PER_CHECK - 1) and self.out_of_time():
+            raise SearchTimeout()
+
+        if game.in_draw(self.root_ply):
+            return DRAW_SCORE
+
+        if ply >= MAX_PLY - 1:
+            return self.evaluate(game)
+
+        # endings with few enough pieces are looked up rather than searched
+        if self.tablebases is not None and game.piece_count() <= self.tablebases.max_pieces:
+            value = self.tablebases.probe(game)
+
+            if value is not None:
+                self.tb_hits += 1
+                return self.tablebase_score(value)
+
+        # a null window means the move leading here is only being tested
+        # against alpha, so the exact score and its PV don't matter
+        pv_node = beta - alpha > 1
+
+        # use a stored result if it was searched at least as deep and is
+        # conclusive for this window (only off the PV, so it stays whole)
+        entry = self.tt.probe(game.hash, ply)
+        if entry and not pv_node:
+            tt_depth, bound, score, _ = entry
+
+            if tt_depth >= depth:
+                if (bound == EXACT or
+                        (bound == LOWER and score >= beta) or
+                        (bound == UPPER and score <= alpha)):
+                    return score
+
+        in_check = game.in_check()
+        futile = False
+
+        # forward pruning, never on the PV or in check
+        if not pv_node and not in_check:
+            static_value = self.evaluate(game)
+
+            # reverse futility: so far above beta that no move of ours
+            # should be able to lose it
+            if (self.reverse_futility and depth <= self.reverse_futility_depth and
+                    abs(beta) < MATE_BOUND and
+                    static_value - self.reverse_futility_margin * depth >= beta):
+                self.pruned["reverse futility"] += 1
+                return static_value
+
+            # razoring: so far below alpha that only a capture could help,
+            # which the quiescence search will find
+            if (self.razoring and depth <= self.razoring_depth and
+                    static_value + self.razoring_margin * depth <= alpha):
+                value = self.quiescence(game, alpha, alpha + 1, ply, 0)
+
+                if value <= alpha:
+                    self.pruned["razoring"] += 1
+                    return value
+
+            # null move: if passing still beats beta, a real move would too
+            if (self.null_move and null_ok and depth >= 2 and
+                    static_value >= beta and abs(beta) < MATE_BOUND):
+                value = self.null_move_search(depth, game, beta, ply)
 
-        moves = game.generate_moves()
-        #random.shuffle(moves)
+                if value is not None:
+                    return value
 
-        if is_max_player:
-            best_value = -9999
+            # futility: quiet moves at the frontier that would need more
+            # than the margin to reach alpha aren't worth searching
+            futile = (self.futility and depth <= self.futility_depth and
+                      abs(alpha) < MATE_BOUND and
+                      static_value + self.futility_margin * depth <= alpha)
+            futile_value = static_value + self.futility_margin * depth
 
-            for move in moves:
-                game.move(move)
-                best_value = max(best_value, self.minimax(depth-1, game, alpha, beta, False))
-                game.undo()
+        alpha_orig = alpha
 
-                alpha = max(alpha, best_value)
-                if beta <= alpha:
-                    return best_value
+        # keep following the last principal variation while we're on it
+        pv_move = 0
+        if self.follow_pv:
+            if ply < len(self.pv):
+                pv_move = self.pv[ply]
+            else:
+                self.follow_pv = False
 
-            return best_value
+        hash_move = pv_move & MOVE_KEY_MASK if pv_move else (entry[3] if entry else 0)
+        last_move = game.last_move()
+        ordering = self.ordering
+        killers = ordering.get_killers(ply)
+        moves = pick_moves(game, hash_move, killers, ordering.get_counter(last_move),
+                           ordering.history)
+        best_value = -INFINITY
+        best_move = 0
+        searched = 0
+
+        for move in moves:
+            if move != pv_move:
+                self.follow_pv = False
+
+            quiet = not move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK)
+            check = game.gives_check(move)
+
+            if futile and best_move and quiet and not check:
+                self.pruned["futility"] += 1
+                best_value = max(best_value, futile_value)
+                continue
+
+            # look a ply further after checks and recaptures, while the line
+            # isn't already much longer than the nominal depth (off the PV
+            # only for checks that capture, to keep the tree from growing)
+            new_depth = depth - 1
+            if self.extensions and ply < self.extension_limit:
+                recapture = (not quiet and last_move & MOVE_CAPTURED_MASK and
+                             not ((move ^ last_move) >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK)
+
+                if (check and (pv_node or not quiet)) or (recapture and pv_node):
+                    new_depth += 1
+
+            game.move(move)
+            searched += 1
+
+            if not best_move:
+                value = -self.negamax(new_depth, game, -beta, -alpha, ply+1)
+            else:
+                # late quiet moves are unlikely to be any good, so they're
+                # searched less deeply first, and fully if they beat alpha
+                reduction = 0
+                if (self.lmr and depth >= self.lmr_depth and searched > self.lmr_moves and
+                        quiet and not check and not in_check and move not in killers):
+                    reduction = LMR_TABLE[depth * LMR_MOVES + min(searched, LMR_MOVES - 1)] - pv_node
+                    reduction = max(min(reduction, new_depth - 1), 0)
+
+                value = -self.negamax(new_depth - reduction, game, -alpha-1, -alpha, ply+1)
+
+                if reduction and value > alpha:
+                    value = -self.negamax(new_depth, game, -alpha-1, -alpha, ply+1)
+
+                if alpha < value < beta:
+                    value = -self.negamax(new_depth, game, -beta, -alpha, ply+1)
+
+            game.undo()
+
+            if value > best_value or not best_move:
+                best_value = value
+                best_move = move
+
+                if value > alpha:
+                    alpha = value
+
+                    if pv_node:
+                        self.update_pv(ply, move)
+
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        self.first_cutoffs += searched == 1
+                        ordering.cutoff(move, ply, depth, last_move)
+                        break
+
+        # checkmate or stalemate, with nearer mates scoring higher
+        if not best_move:
+            return -MATE + ply if in_check else DRAW_SCORE
+
+        if best_value <= alpha_orig:
+            bound = UPPER
+        elif best_value >= beta:
+            bound = LOWER
         else:
-            best_value = 9999
+            bound = EXACT
+
+        self.tt.store(game.hash, depth, bound, best_value, best_move, ply)
+
+        return best_value
+
+    def null_move_search(self, depth, game, beta, ply):
+        # the score to cut off with if passing the turn still fails high,
+        # None if the node has to be searched properly
+        material = game.non_pawn_material()
+
+        # with only pawns left, passing is often better than any real move
+        if not material:
+            return None
+
+        reduced = max(depth - 1 - self.null_move_reduction - depth // 6, 0)
+
+        game.move_null()
+        value = -self.negamax(reduced, game, -beta, -beta + 1, ply + 1, False)
+        game.undo_null()
+
+        if value < beta:
+            return None
+
+        # a mate found by passing isn't a real one
+        if value >= MATE_BOUND:
+            value = beta
 
-            for move in moves:
-                game.move(move)
-                best_value = min(best_value, self.minimax(depth-1, game, alpha, beta, True))
-                game.undo()
+        # with few pieces left zugzwang is likely enough that the cutoff has
+        # to be confirmed by a reduced search that doesn't pass
+        if material <= self.null_move_verify:
+            if self.negamax(reduced, game, beta - 1, beta, ply, False) < beta:
+                self.pruned["null move refuted"] += 1
+                return None
 
-                beta = min(beta, best_value)
-                if beta <= alpha:
-                    return best_value
+        self.pruned["null move"] += 1
+        return value
 
-            return best_value
+    def quiescence(self, game, alpha, beta, ply, qdepth):
+        # resolve captures and promotions past the horizon so the position
+        # we evaluate isn't in the middle of a trade
+        self.qnodes += 1
+        self.pv_length[ply] = ply
+
+        if ply > self.seldepth:
+            self.seldepth = ply
+
+        if not self.qnodes & (NODES_PER_CHECK - 1) and self.out_of_time():
+            raise SearchTimeout()
+
+        # only the first ply can have been reached by a quiet move
+        if not qdepth and game.in_draw(self.root_ply):
+            return DRAW_SCORE
+
+        in_check = game.in_check()
+
+        # in check there's no standing pat, every evasion has to be tried
+        # (unless a run of checks has reached the end of the PV table)
+        if in_check:
+            if ply >= MAX_PLY - 1:
+                return self.evaluate(game)
+
+            best_value = -INFINITY
+            moves = game.generate_moves()
+
+            if not moves:
+                return -MATE + ply
+        else:
+            # the side to move can usually at least keep the current score
+            # by not capturing anything
+            best_value = self.evaluate(game)
+
+            if best_value >= beta or qdepth >= self.qsearch_depth or ply >= MAX_PLY - 1:
+                return best_value
+
+            alpha = max(alpha, best_value)
+            moves = game.generate_moves(captures=True)
+            moves.sort(key=capture_order, reverse=True)
+
+        for move in moves:
+            if not in_check:
+                # delta pruning: skip captures that can't bring the score
+                # back up to alpha even if the capturing piece isn't lost
+                gain = CODE_VALUES[(move >> MOVE_CAPTURED_SHIFT) & 7]
+                if move & MOVE_PROMOTION_MASK:
+                    gain += CODE_VALUES[(move >> MOVE_PROMOTION_SHIFT) & 7] - PIECE_VALUES[PAWN]
+
+                if best_value + gain + DELTA_MARGIN <= alpha or losing_capture(game, move):
+                    continue
+
+            game.move(move)
+            value = -self.quiescence(game, -beta, -alpha, ply+1, qdepth+1)
+            game.undo()
+
+            if value > best_value:
+                best_value = value
+
+                if value > alpha:
+                    alpha = value
+
+                    if alpha >= beta:
+                        break
+
+        return best_value
+
+    def out_of_time(self):
+        return default_timer() >= self.deadline or (self.stop is not None and self.stop.is_set())
+
+    def evaluate(self, game):
+        # the material and PST value from the side to move's point of view
+        return game.get_value() if game.turn == WHITE else -game.get_value()
+
+    def update_pv(self, ply, move):
+        # this ply's row of the triangular table becomes the move followed
+        # by the row of the ply below it
+        row = ply * MAX_PLY
+        child = row + MAX_PLY
+        length = self.pv_length[ply + 1]
+
+        self.pv_table[row + ply] = move
+        self.pv_table[row + ply + 1:row + length] = self.pv_table[child + ply + 1:child + length]
+        self.pv_length[ply] = length
+
+    def get_flag(self, key, default=True):
+        # an on/off setting, where "0", "false", "no" and "off" turn it off
+        value = self.get_setting(key)
+
+        if value is None:
+            return default
+
+        return value.lower() not in ("0", "false", "no", "off")
+
+    def format_moves(self, moves):
+        # long algebraic notation, e.g. e2e4 or e7e8q
+        names = []
+
+        for move in moves:
+            move = self.chess.get_move(move)
+            names.append(self.chess.get_san(move.m_from) + self.chess.get_san(move.m_to) + move.promotion)
+
+        return ' '.join(names)
+
+    def format_score(self, score):
+        # in pawns, or the number of moves to a forced mate
+        if score >= MATE_BOUND:
+            return "mate {}".format((MATE - score + 1) // 2)
+        if score <= -MATE_BOUND:
+            return "mate -{}".format((MATE + score) // 2)
+        if score > TB_BOUND:
+            return "tablebase mate {}".format((TB_WIN - score + 1) // 2)
+        if score < -TB_BOUND:
+            return "tablebase mate -{}".format((TB_WIN + score) // 2)
+
+        return "{:+.2f}".format(score / PIECE_VALUES[PAWN])
 
     def print_current_board(self):
         """Prints the current board using pretty ASCII art
@@ -203,3 +1107,93 @@ class AI(BaseAI):
             print(output)
 
     # <<-- /Creer-Merge: functions -->>
+
+
+# each pool worker keeps a search of its own, with its tables kept warm
+# across the tasks it's given, and the last root position it rebuilt
+_worker = None
+_root = None
+_root_data = None
+
+
+def _init_worker(settings, stop, tt_name):
+    global _worker
+    _worker = AI(None)
+    _worker.set_settings(settings)
+    _worker.init_search(TranspositionTable(name=tt_name) if tt_name else None)
+    _worker.stop = stop
+
+
+def _root_game(data):
+    # the root position, only rebuilt when it's a new one
+    global _root, _root_data
+
+    if data != _root_data:
+        _root = _worker.backend.deserialize(data, _worker.debug)
+        _root_data = data
+        _worker.tt.new_search()
+        _worker.ordering.new_search()
+
+    return _root
+
+
+def _reset_stats(ai):
+    ai.nodes = ai.qnodes = ai.cutoffs = ai.first_cutoffs = ai.tb_hits = ai.seldepth = 0
+    ai.pruned = dict.fromkeys(PRUNING_KINDS, 0)
+    ai.tt.probes = ai.tt.hits = ai.tt.collisions = 0
+
+
+def _search_move(args):
+    # search one root move with a null window at the first move's bound,
+    # and with the full window if it beats it
+    data, move, depth, alpha, beta, deadline = args
+    ai = _worker
+    game = _root_game(data)
+
+    ai.root_ply = game.ply
+    ai.deadline = deadline
+    ai.extension_limit = depth * 2
+    ai.pv = []
+    ai.follow_pv = False
+    _reset_stats(ai)
+    pv = []
+
+    # moves still queued when the search is called off are skipped whole
+    if ai.out_of_time():
+        return move, None, pv, ai.get_stats()
+
+    game.move(move)
+
+    try:
+        value = -ai.negamax(depth-1, game, -alpha-1, -alpha, 1)
+
+        if alpha < value < beta:
+            value = -ai.negamax(depth-1, game, -beta, -alpha, 1)
+            pv = ai.pv_table[MAX_PLY + 1:MAX_PLY + ai.pv_length[1]].tolist()
+    except SearchTimeout:
+        value = None
+
+    # unwind whatever the search had left on the board
+    while game.ply > ai.root_ply:
+        if game.last_move():
+            game.undo()
+        else:
+            game.undo_null()
+
+    return move, value, pv, ai.get_stats()
+
+
+def _lazy_search(args):
+    # search the whole root as a Lazy SMP helper, returning the deepest
+    # iteration it finished
+    data, helper, depth_limit, deadline, age = args
+    ai = _worker
+    game = _root_game(data)
+
+    ai.tt.age = age
+    ai.depth_limit = depth_limit
+    ai.time_manager.hard_deadline = deadline
+    _reset_stats(ai)
+    ai.iterative_deepening(game, helper)
+
+    return ai.depth, ai.score, ai.pv, ai.get_stats()
@@ -0,0 +1,961 @@
+from array import array
+
+from games.chess import engine
+
+# local imports
+from games.chess.constants import *
+
+# internal color and piece type indices
+COLORS = [WHITE, BLACK]
+TYPES = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+
+COLOR_INDEX = {WHITE: 0, BLACK: 1}
+TYPE_INDEX = {type: i for i, type in enumerate(TYPES)}
+
+P, N, B, R, Q, K = range(6)
+
+# squares are numbered a1 = 0 through h8 = 63
+A1, C1, D1, E1, F1, G1, H1 = 0, 2, 3, 4, 5, 6, 7
+A8, C8, D8, E8, F8, G8, H8 = 56, 58, 59, 60, 61, 62, 63
+
+RANK_2_MASK = 0xFF << 8
+RANK_7_MASK = 0xFF << 48
+PROMOTION_MASK = 0xFF | (0xFF << 56)
+LIGHT_SQUARES = 0x55AA55AA55AA55AA
+
+# map of bitboard squares to 0x88 squares
+SQ88 = [(7 - (sq >> 3)) * 16 + (sq & 7) for sq in range(64)]
+
+# combined material and PST values by color, type and square
+VALUES = [[[SQUARE_VALUES[color][type][SQ88[sq]] for sq in range(64)] for type in TYPES]
+          for color in COLORS]
+
+# squares that lose castling rights when moved from or captured on
+CASTLING_MASKS = [[0] * 64, [0] * 64]
+CASTLING_MASKS[0][A1] = QSIDE_CASTLE
+CASTLING_MASKS[0][H1] = KSIDE_CASTLE
+CASTLING_MASKS[0][E1] = QSIDE_CASTLE | KSIDE_CASTLE
+CASTLING_MASKS[1][A8] = QSIDE_CASTLE
+CASTLING_MASKS[1][H8] = KSIDE_CASTLE
+CASTLING_MASKS[1][E8] = QSIDE_CASTLE | KSIDE_CASTLE
+
+# rook (from, to) squares for castling, indexed by color and castling flag
+CASTLING_ROOKS = [
+    {KSIDE_CASTLE: (H1, F1), QSIDE_CASTLE: (A1, D1)},
+    {KSIDE_CASTLE: (H8, F8), QSIDE_CASTLE: (A8, D8)}
+]
+
+
+# Zobrist keys indexed by color, type and square (polyglot numbers squares
+# the same way)
+PIECE_KEYS = [[POLYGLOT_RANDOM[64 * (2*type + (color == 0)):][:64] for type in range(6)]
+              for color in (0, 1)]
+CASTLING_KEYS = [ZOBRIST_CASTLING[WHITE], ZOBRIST_CASTLING[BLACK]]
+
+
+def _leaper_attacks(deltas):
+    attacks = []
+
+    for sq in range(64):
+        rank, file = sq >> 3, sq & 7
+        bb = 0
+
+        for d_rank, d_file in deltas:
+            r, f = rank + d_rank, file + d_file
+
+            if 0 <= r < 8 and 0 <= f < 8:
+                bb |= 1 << (r * 8 + f)
+
+        attacks.append(bb)
+
+    return attacks
+
+
+def _ray(sq, d_rank, d_file, occupied=0):
+    bb = 0
+    r, f = (sq >> 3) + d_rank, (sq & 7) + d_file
+
+    while 0 <= r < 8 and 0 <= f < 8:
+        bit = 1 << (r * 8 + f)
+        bb |= bit
+
+        # stop at the first blocker
+        if occupied & bit:
+            break
+
+        r, f = r + d_rank, f + d_file
+
+    return bb
+
+
+def _inner_ray(sq, d_rank, d_file):
+    # the ray without its last square, which never blocks anything beyond it
+    bb = 0
+    r, f = (sq >> 3) + d_rank, (sq & 7) + d_file
+
+    while 0 <= r + d_rank < 8 and 0 <= f + d_file < 8:
+        bb |= 1 << (r * 8 + f)
+        r, f = r + d_rank, f + d_file
+
+    return bb
+
+
+def _line_tables(directions):
+    # for every square and every line through it, map each subset of the
+    # relevant occupancy to the attack set along that line
+    tables = []
+
+    for sq in range(64):
+        lines = []
+
+        for d_rank, d_file in directions:
+            mask = _inner_ray(sq, d_rank, d_file) | _inner_ray(sq, -d_rank, -d_file)
+            table = {}
+
+            # enumerate every subset of the mask (carry-rippler)
+            subset = 0
+            while True:
+                table[subset] = (_ray(sq, d_rank, d_file, subset) |
+                                 _ray(sq, -d_rank, -d_file, subset))
+                subset = (subset - mask) & mask
+
+                if not subset:
+                    break
+
+            lines.append((mask, table))
+
+        tables.append(tuple(lines))
+
+    return tables
+
+
+KNIGHT_ATTACKS = _leaper_attacks(
+    [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _leaper_attacks(
+    [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+PAWN_ATTACKS = [_leaper_attacks([(1, -1), (1, 1)]),
+                _leaper_attacks([(-1, -1), (-1, 1)])]
+
+ROOK_LINES = _line_tables([(0, 1), (1, 0)])
+BISHOP_LINES = _line_tables([(1, 1), (1, -1)])
+
+
+def _between_table():
+    # squares strictly between two squares on a shared line, indexed
+    # by 64 * a + b
+    table = [0] * 4096
+
+    for sq in range(64):
+        for d_rank, d_file in [(0, 1), (1, 0), (1, 1), (1, -1),
+                               (0, -1), (-1, 0), (-1, -1), (-1, 1)]:
+            bb = 0
+            r, f = (sq >> 3) + d_rank, (sq & 7) + d_file
+
+            while 0 <= r < 8 and 0 <= f < 8:
+                table[64 * sq + r * 8 + f] = bb
+                bb |= 1 << (r * 8 + f)
+                r, f = r + d_rank, f + d_file
+
+    return table
+
+
+BETWEEN = _between_table()
+
+
+def rook_attacks(sq, occupied):
+    (m1, t1), (m2, t2) = ROOK_LINES[sq]
+    return t1[occupied & m1] | t2[occupied & m2]
+
+
+def bishop_attacks(sq, occupied):
+    (m1, t1), (m2, t2) = BISHOP_LINES[sq]
+    return t1[occupied & m1] | t2[occupied & m2]
+
+
+class BitboardChess:
+    # map piece types for framework
+    PIECE_MAP = engine.Chess.PIECE_MAP
+
+    def __init__(self, fen=DEFAULT_FEN, debug=False):
+        # one bitboard per color and piece type, plus occupancy per color
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        # (color, type) of the piece on each square, for captures and printing
+        self.mailbox = [None] * 64
+        self.castling = [0, 0]
+        # preallocated stack of undo records, one per ply
+        self.history = [[None] * 6 for _ in range(MAX_HISTORY)]
+        # hash of the position before each ply, for repetition detection
+        self.hashes = [0] * MAX_HISTORY
+        self.ply = 0
+        # Polyglot compatible Zobrist key of the position
+        self.hash = 0
+        # running material and PST value of the position
+        self.value = 0
+        # check incremental state against a full recompute
+        self.debug = debug
+
+        self.load(fen)
+
+    def get_value(self):
+        if self.debug:
+            assert self.value == self.compute_value(), self.generate_fen()
+
+        return self.value
+
+    def compute_value(self):
+        value = 0
+
+        for color in (0, 1):
+            pst = PST_VALUES[COLORS[color]]
+            sign = 1 if color == 0 else -1
+
+            for type, bb in enumerate(self.pieces[color]):
+                piece_value = PIECE_VALUES[TYPES[type]]
+                table = pst[TYPES[type]]
+
+                while bb:
+                    bit = bb & -bb
+                    bb ^= bit
+                    value += sign * (piece_value + table[SQ88[bit.bit_length() - 1]])
+
+        return value
+
+    def load(self, fen):
+        tokens = fen.split()
+        square = 56
+
+        for piece in tokens[0]:
+            if piece == '/':
+                square -= 16
+            elif piece.isdigit():
+                square += int(piece)
+            else:
+                color = 0 if piece.isupper() else 1
+                self.place_piece(color, TYPE_INDEX[piece.lower()], square)
+                square += 1
+
+        self.turn = tokens[1]
+
+        if 'K' in tokens[2]:
+            self.castling[0] |= KSIDE_CASTLE
+        if 'Q' in tokens[2]:
+            self.castling[0] |= QSIDE_CASTLE
+        if 'k' in tokens[2]:
+            self.castling[1] |= KSIDE_CASTLE
+        if 'q' in tokens[2]:
+            self.castling[1] |= QSIDE_CASTLE
+
+        self.ep_square = EMPTY if tokens[3] == '-' else BitboardChess.get_square(tokens[3])
+        self.half_moves = int(tokens[4])
+        self.move_number = int(tokens[5])
+
+        self.hash = self.compute_hash()
+
+    def compute_hash(self):
+        key = 0
+
+        for sq, piece in enumerate(self.mailbox):
+            if piece is not None:
+                key ^= PIECE_KEYS[piece[0]][piece[1]][sq]
+
+        key ^= CASTLING_KEYS[0][self.castling[0]]
+        key ^= CASTLING_KEYS[1][self.castling[1]]
+        key ^= self.ep_hash()
+
+        if self.turn == WHITE:
+            key ^= ZOBRIST_TURN
+
+        return key
+
+    def ep_hash(self):
+        # polyglot only hashes the en passant file if a pawn can capture there
+        if self.ep_square == EMPTY:
+            return 0
+
+        us = COLOR_INDEX[self.turn]
+
+        if PAWN_ATTACKS[us ^ 1][self.ep_square] & self.pieces[us][P]:
+            return ZOBRIST_EP[self.ep_square & 7]
+
+        return 0
+
+    def generate_fen(self):
+        ranks = []
+
+        for rank in range(7, -1, -1):
+            empty = 0
+            fen = ""
+
+            for sq in range(rank * 8, rank * 8 + 8):
+                piece = self.mailbox[sq]
+
+                if piece is None:
+                    empty += 1
+                    continue
+
+                if empty > 0:
+                    fen += str(empty)
+                    empty = 0
+
+                type = TYPES[piece[1]]
+                fen += type.upper() if piece[0] == 0 else type
+
+            if empty > 0:
+                fen += str(empty)
+
+            ranks.append(fen)
+
+        # add castling permissions
+        cflags = ''
+        if self.castling[0] & KSIDE_CASTLE:
+            cflags += 'K'
+        if self.castling[0] & QSIDE_CASTLE:
+            cflags += 'Q'
+        if self.castling[1] & KSIDE_CASTLE:
+            cflags += 'k'
+        if self.castling[1] & QSIDE_CASTLE:
+            cflags += 'q'
+
+        # if castling flag is empty, replace with dash
+        cflags = cflags or '-'
+
+        epflags = '-' if self.ep_square == EMPTY else BitboardChess.get_san(self.ep_square)
+
+        return ' '.join(
+            ['/'.join(ranks), self.turn, cflags, epflags, str(self.half_moves), str(self.move_number)])
+
+    def get_piece(self, square):
+        piece = self.mailbox[BitboardChess.get_square(square)]
+        return None if piece is None else engine.PIECES[COLORS[piece[0]]][TYPES[piece[1]]]
+
+    def get_move(self, move):
+        return Move(move)
+
+    def last_move(self):
+        # the packed move that led to this position, 0 at the start
+        return self.history[self.ply - 1][0] if self.ply else 0
+
+    def serialize(self):
+        # the FEN from before the last irreversible move and the packed
+        # moves since, which is all it takes to rebuild the position along
+        # with the positions it could still repeat
+        moves = [self.history[ply][0] for ply in range(max(self.ply - self.half_moves, 0), self.ply)]
+
+        for _ in moves:
+            self.undo()
+
+        fen = self.generate_fen()
+
+        for move in moves:
+            self.move(move)
+
+        return fen, array('L', moves).tobytes()
+
+    @classmethod
+    def deserialize(cls, data, debug=False):
+        fen, moves = data
+        game = cls(fen, debug)
+        packed = array('L')
+        packed.frombytes(moves)
+
+        for move in packed:
+            game.move(move)
+
+        return game
+
+    def place_piece(self, color, type, sq):
+        bit = 1 << sq
+        self.pieces[color][type] |= bit
+        self.occupied[color] |= bit
+        self.mailbox[sq] = (color, type)
+        self.value += VALUES[color][type][sq]
+
+    def remove_piece(self, sq):
+        color, type = self.mailbox[sq]
+        bit = 1 << sq
+        self.pieces[color][type] ^= bit
+        self.occupied[color] ^= bit
+        self.mailbox[sq] = None
+        self.value -= VALUES[color][type][sq]
+
+    def print(self):
+        print("   +" + '-'*24 + '+')
+
+        for rank in range(7, -1, -1):
+            print(" {} |".format(rank + 1), end='')
+
+            for sq in range(rank * 8, rank * 8 + 8):
+                piece = self.mailbox[sq]
+
+                if piece is None:
+                    print(" . ", end='')
+                else:
+                    type = TYPES[piece[1]]
+                    print(' ' + (type.upper() if piece[0] == 0 else type) + ' ', end='')
+
+            print('|')
+
+        print("   +" + '-'*24 + '+')
+        print("     " + "  ".join(list("abcdefgh")))
+
+    def generate_moves(self, legal=True, single_square="", captures=None):
+        # captures selects only captures and promotions (True), only quiet
+        # moves (False) or everything (None)
+        moves = []
+        us = COLOR_INDEX[self.turn]
+        color_bit = MOVE_BLACK if us else 0
+        them = us ^ 1
+        pieces = self.pieces[us]
+        mailbox = self.mailbox
+        own = self.occupied[us]
+        enemy = self.occupied[them]
+        occupied = own | enemy
+
+        # squares we're allowed to move from
+        from_mask = BitboardChess.get_bit(single_square) if single_square else own
+
+        # squares we're allowed to move to, and to push pawns to
+        if captures is None:
+            to_mask, push_mask = ~own, ~0
+        elif captures:
+            to_mask, push_mask = enemy, PROMOTION_MASK
+        else:
+            to_mask, push_mask = ~occupied, ~PROMOTION_MASK
+
+        # squares that capture or block a check, and the lines pinned pieces
+        # are restricted to
+        evasions = ~0
+        pins = {}
+        ep_moves = []
+
+        if legal:
+            checkers, evasions, pins = self.checks_and_pins(us)
+
+            # in double check only the king can move
+            if checkers & (checkers - 1):
+                from_mask &= pieces[K]
+
+        def add_move(m_from, m_to, flags, type):
+            captured = mailbox[m_to]
+            move = (m_from | m_to << MOVE_TO_SHIFT |
+                    (type + 1) << MOVE_PIECE_SHIFT |
+                    flags << MOVE_FLAGS_SHIFT | color_bit)
+
+            if captured:
+                move |= (captured[1] + 1) << MOVE_CAPTURED_SHIFT
+            elif flags & EP_CAPTURE:
+                move |= PAWN_CODE << MOVE_CAPTURED_SHIFT
+
+                # en passant can expose the king along the rank, so it's tried
+                # once we're done generating
+                if legal:
+                    ep_moves.append(move)
+                    return
+
+            moves.append(move)
+
+        def add_targets(m_from, type, targets):
+            if legal:
+                targets &= evasions & pins.get(m_from, ~0)
+
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                add_move(m_from, bit.bit_length() - 1,
+                         CAPTURE if bit & enemy else NORMAL, type)
+
+        def add_pawn_move(m_from, m_to, flags):
+            captured = mailbox[m_to]
+            move = (m_from | m_to << MOVE_TO_SHIFT |
+                    PAWN_CODE << MOVE_PIECE_SHIFT |
+                    flags << MOVE_FLAGS_SHIFT | color_bit)
+
+            if captured:
+                move |= (captured[1] + 1) << MOVE_CAPTURED_SHIFT
+
+            if (1 << m_to) & PROMOTION_MASK:
+                move |= PROMOTION << MOVE_FLAGS_SHIFT
+
+                for code in PROMOTION_CODES:
+                    moves.append(move | code << MOVE_PROMOTION_SHIFT)
+            else:
+                moves.append(move)
+
+        # pawns
+        bb = pieces[P] & from_mask
+        forward = 8 if us == 0 else -8
+        second_rank = RANK_2_MASK if us == 0 else RANK_7_MASK
+        pawn_attacks = PAWN_ATTACKS[us]
+        ep_bit = 0 if self.ep_square == EMPTY else 1 << self.ep_square
+
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            sq = bit.bit_length() - 1
+
+            # destination squares that keep the king safe
+            allowed = evasions & pins.get(sq, ~0)
+
+            # single square non-capture
+            to = sq + forward
+            if not occupied & (1 << to):
+                if allowed & push_mask & (1 << to):
+                    add_pawn_move(sq, to, NORMAL)
+
+                # double square
+                to += forward
+                if (bit & second_rank and not occupied & (1 << to) and
+                        allowed & push_mask & (1 << to)):
+                    add_pawn_move(sq, to, BIG_PAWN)
+
+            if captures is False:
+                continue
+
+            # pawn captures
+            targets = pawn_attacks[sq] & enemy & allowed
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                add_pawn_move(sq, target.bit_length() - 1, CAPTURE)
+
+            # en passant capture
+            if pawn_attacks[sq] & ep_bit:
+                add_move(sq, self.ep_square, EP_CAPTURE, P)
+
+        # knights
+        bb = pieces[N] & from_mask
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            sq = bit.bit_length() - 1
+            add_targets(sq, N, KNIGHT_ATTACKS[sq] & to_mask)
+
+        # bishops and queens along diagonals
+        bb = (pieces[B] | pieces[Q]) & from_mask
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            sq = bit.bit_length() - 1
+            add_targets(sq, mailbox[sq][1], bishop_attacks(sq, occupied) & to_mask)
+
+        # rooks and queens along ranks and files
+        bb = (pieces[R] | pieces[Q]) & from_mask
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            sq = bit.bit_length() - 1
+            add_targets(sq, mailbox[sq][1], rook_attacks(sq, occupied) & to_mask)
+
+        # king
+        bb = pieces[K] & from_mask
+        if bb:
+            king = bb.bit_length() - 1
+            targets = KING_ATTACKS[king] & to_mask
+
+            # lift the king so it can't hide behind itself from a slider
+            lifted = occupied ^ bb
+
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to = bit.bit_length() - 1
+
+                if not legal or not self.is_attacked(to, them, lifted):
+                    add_move(king, to, CAPTURE if bit & enemy else NORMAL, K)
+
+            castling = self.castling[us] if captures is not True else 0
+
+            # kingside castling
+            if castling & KSIDE_CASTLE:
+                # if the path is clear, we're not in check and won't be in check
+                if (not occupied & (3 << (king+1)) and
+                        not self.is_attacked(king, them) and
+                        not self.is_attacked(king+1, them) and
+                        not self.is_attacked(king+2, them)):
+                    add_move(king, king+2, KSIDE_CASTLE, K)
+
+            # queenside castling
+            if castling & QSIDE_CASTLE:
+                # if the path is clear, we're not in check and won't be in check
+                if (not occupied & (7 << (king-3)) and
+                        not self.is_attacked(king, them) and
+                        not self.is_attacked(king-1, them) and
+                        not self.is_attacked(king-2, them)):
+                    add_move(king, king-2, QSIDE_CASTLE, K)
+
+        for move in ep_moves:
+            self.move(move)
+
+            if not self.king_attacked(COLORS[us]):
+                moves.append(move)
+
+            self.undo()
+
+        return moves
+
+    def checks_and_pins(self, us):
+        # find the pieces giving check to our king (as a bitboard, along with
+        # the squares that would capture or block them) and our pieces pinned
+        # to it (along with the line they can still move on)
+        them = us ^ 1
+        pieces = self.pieces[them]
+        own = self.occupied[us]
+        occupied = own | self.occupied[them]
+        king = self.pieces[us][K].bit_length() - 1
+
+        checkers = ((KNIGHT_ATTACKS[king] & pieces[N]) |
+                    (PAWN_ATTACKS[us][king] & pieces[P]))
+        evasions = checkers
+        pins = {}
+
+        # enemy sliders that see the king through nothing but our pieces
+        snipers = ((bishop_attacks(king, occupied ^ own) & (pieces[B] | pieces[Q])) |
+                   (rook_attacks(king, occupied ^ own) & (pieces[R] | pieces[Q])))
+
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            line = BETWEEN[64 * king + bit.bit_length() - 1]
+            blockers = line & own
+
+            if not blockers:
+                checkers |= bit
+                evasions |= line | bit
+            elif not blockers & (blockers - 1):
+                pins[blockers.bit_length() - 1] = line | bit
+
+        if not checkers:
+            evasions = ~0
+
+        return checkers, evasions, pins
+
+    def gives_check(self, move):
+        # special moves are rare, so just try them
+        if (move >> MOVE_FLAGS_SHIFT) & (EP_CAPTURE | KSIDE_CASTLE | QSIDE_CASTLE):
+            self.move(move)
+            check = self.in_check()
+            self.undo()
+
+            return check
+
+        us = 1 if move & MOVE_BLACK else 0
+        pieces = self.pieces[us]
+        king = self.pieces[us ^ 1][K].bit_length() - 1
+        from_bit = 1 << (move & MOVE_SQUARE_MASK)
+        to_bit = 1 << ((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK)
+        type = ((move >> MOVE_PROMOTION_SHIFT) & 7 or (move >> MOVE_PIECE_SHIFT) & 7) - 1
+
+        # occupancy and our sliders once the move is made
+        occupied = (self.occupied[0] | self.occupied[1] | to_bit) ^ from_bit
+        diagonal = (pieces[B] | pieces[Q]) & ~from_bit
+        straight = (pieces[R] | pieces[Q]) & ~from_bit
+
+        if type == P:
+            return bool(PAWN_ATTACKS[us ^ 1][king] & to_bit or
+                        bishop_attacks(king, occupied) & diagonal or
+                        rook_attacks(king, occupied) & straight)
+        if type == N and KNIGHT_ATTACKS[king] & to_bit:
+            return True
+        if type == B or type == Q:
+            diagonal |= to_bit
+        if type == R or type == Q:
+            straight |= to_bit
+
+        return bool(bishop_attacks(king, occupied) & diagonal or
+                    rook_attacks(king, occupied) & straight)
+
+    def is_attacked(self, sq, by, occupied=None):
+        pieces = self.pieces[by]
+
+        if KNIGHT_ATTACKS[sq] & pieces[N]:
+            return True
+        if KING_ATTACKS[sq] & pieces[K]:
+            return True
+        # a pawn attacks sq if sq's own pawn attacks (for the other color) hit it
+        if PAWN_ATTACKS[by ^ 1][sq] & pieces[P]:
+            return True
+
+        if occupied is None:
+            occupied = self.occupied[0] | self.occupied[1]
+
+        if bishop_attacks(sq, occupied) & (pieces[B] | pieces[Q]):
+            return True
+        if rook_attacks(sq, occupied) & (pieces[R] | pieces[Q]):
+            return True
+
+        return False
+
+    def attacked(self, color, square):
+        return self.is_attacked(square, COLOR_INDEX[color])
+
+    def king_attacked(self, color):
+        us = COLOR_INDEX[color]
+        return self.is_attacked(self.pieces[us][K].bit_length() - 1, us ^ 1)
+
+    def in_check(self):
+        return self.king_attacked(self.turn)
+
+    def in_checkmate(self):
+        return self.in_check() and not self.generate_moves()
+
+    def in_stalemate(self):
+        return not self.in_check() and not self.generate_moves()
+
+    def non_pawn_material(self):
+        # value of the side to move's knights, bishops, rooks and queens
+        pieces = self.pieces[COLOR_INDEX[self.turn]]
+        return sum(PIECE_VALUES[TYPES[type]] * bin(pieces[type]).count('1') for type in (N, B, R, Q))
+
+    def piece_count(self):
+        return bin(self.occupied[0] | self.occupied[1]).count('1')
+
+    def piece_list(self):
+        # (color, type, square) of every piece
+        return [(COLORS[piece[0]], TYPES[piece[1]], sq) for sq, piece in enumerate(self.mailbox) if piece]
+
+    def insufficient_material(self):
+        white, black = self.pieces
+        num_pieces = bin(self.occupied[0] | self.occupied[1]).count('1')
+
+        # K vs. K
+        if num_pieces == 2:
+            return True
+
+        knights = white[N] | black[N]
+        bishops = white[B] | black[B]
+
+        # K vs. KN or K vs. KB
+        if num_pieces == 3 and (knights or bishops):
+            return True
+
+        # KB vs. KB where any number of bishops are all the same color
+        if num_pieces == bin(bishops).count('1') + 2:
+            return not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES
+
+        return False
+
+    def in_threefold_repetition(self, root_ply=None):
+        # compare hashes of earlier positions with the same side to move, as
+        # far back as the last capture or pawn move (none before it can recur)
+        hashes = self.hashes
+        key = self.hash
+        count = 0
+
+        for i in range(self.ply - 4, max(self.ply - self.half_moves, 0) - 1, -2):
+            if hashes[i] == key:
+                # within the search a single repetition is as good as a draw
+                if root_ply is not None and i >= root_ply:
+                    return True
+
+                count += 1
+                if count == 2:
+                    return True
+
+        return False
+
+    def in_draw(self, root_ply=None):
+        return (self.half_moves >= 100 or
+                self.in_threefold_repetition(root_ply) or
+                self.insufficient_material())
+
+    def game_over(self):
+        return self.half_moves >= 50 or self.in_checkmate() or self.in_draw()
+
+    def move(self, move):
+        us = COLOR_INDEX[self.turn]
+        them = us ^ 1
+        m_from = move & MOVE_SQUARE_MASK
+        m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        flags = move >> MOVE_FLAGS_SHIFT
+        captured = self.mailbox[m_to]
+
+        # grow the undo stack if the game outlasts it
+        if self.ply == len(self.history):
+            self.history.extend([None] * 6 for _ in range(MAX_HISTORY))
+            self.hashes.extend([0] * MAX_HISTORY)
+
+        # save only what can't be recovered from the move itself
+        record = self.history[self.ply]
+        record[0] = move
+        record[1] = captured
+        record[2] = self.castling[0]
+        record[3] = self.castling[1]
+        record[4] = self.ep_square
+        record[5] = self.half_moves
+        self.hashes[self.ply] = self.hash
+        self.ply += 1
+
+        key = self.hash ^ ZOBRIST_TURN
+
+        if self.ep_square != EMPTY:
+            key ^= self.ep_hash()
+
+        if captured is not None:
+            self.remove_piece(m_to)
+            key ^= PIECE_KEYS[them][captured[1]][m_to]
+
+        type = self.mailbox[m_from][1]
+        self.remove_piece(m_from)
+        key ^= PIECE_KEYS[us][type][m_from]
+
+        # reset the 50 move counter if a pawn is moved or a piece is captured
+        if type == P or captured is not None or flags & EP_CAPTURE:
+            self.half_moves = 0
+        else:
+            self.half_moves += 1
+
+        # if pawn promotion, place the new piece instead
+        if flags & PROMOTION:
+            type = ((move >> MOVE_PROMOTION_SHIFT) & 7) - 1
+
+        self.place_piece(us, type, m_to)
+        key ^= PIECE_KEYS[us][type][m_to]
+
+        # if en passant capture, remove the captured pawn
+        if flags & EP_CAPTURE:
+            ep_pawn = m_to - 8 if us == 0 else m_to + 8
+            self.remove_piece(ep_pawn)
+            key ^= PIECE_KEYS[them][P][ep_pawn]
+
+        # if we castled, move the rook next to the king
+        if flags & (KSIDE_CASTLE | QSIDE_CASTLE):
+            rook_from, rook_to = CASTLING_ROOKS[us][flags & (KSIDE_CASTLE | QSIDE_CASTLE)]
+            self.remove_piece(rook_from)
+            self.place_piece(us, R, rook_to)
+            key ^= PIECE_KEYS[us][R][rook_from] ^ PIECE_KEYS[us][R][rook_to]
+
+        # remove castling permissions if a king or rook moves or a rook is captured
+        castling = self.castling
+        if castling[us] & CASTLING_MASKS[us][m_from]:
+            key ^= CASTLING_KEYS[us][castling[us]]
+            castling[us] &= ~CASTLING_MASKS[us][m_from]
+            key ^= CASTLING_KEYS[us][castling[us]]
+        if castling[them] & CASTLING_MASKS[them][m_to]:
+            key ^= CASTLING_KEYS[them][castling[them]]
+            castling[them] &= ~CASTLING_MASKS[them][m_to]
+            key ^= CASTLING_KEYS[them][castling[them]]
+
+        # if big pawn move, update the en passant square
+        if flags & BIG_PAWN:
+            self.ep_square = m_to - 8 if us == 0 else m_to + 8
+        else:
+            self.ep_square = EMPTY
+
+        if us == 1:
+            self.move_number += 1
+
+        self.turn = COLORS[them]
+        if self.ep_square != EMPTY:
+            key ^= self.ep_hash()
+
+        self.hash = key
+
+    def undo(self):
+        # stack is empty
+        if not self.ply:
+            return None
+
+        self.ply -= 1
+        (move, captured, castling_white, castling_black,
+            ep_square, half_moves) = self.history[self.ply]
+
+        them = COLOR_INDEX[self.turn]
+        us = them ^ 1
+        m_from = move & MOVE_SQUARE_MASK
+        m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        flags = move >> MOVE_FLAGS_SHIFT
+
+        self.turn = COLORS[us]
+        self.castling[0] = castling_white
+        self.castling[1] = castling_black
+        self.ep_square = ep_square
+        self.half_moves = half_moves
+        self.hash = self.hashes[self.ply]
+
+        if us == 1:
+            self.move_number -= 1
+
+        # put the rook back in the corner
+        if flags & (KSIDE_CASTLE | QSIDE_CASTLE):
+            rook_from, rook_to = CASTLING_ROOKS[us][flags & (KSIDE_CASTLE | QSIDE_CASTLE)]
+            self.remove_piece(rook_to)
+            self.place_piece(us, R, rook_from)
+
+        # undo any promotions
+        self.remove_piece(m_to)
+        self.place_piece(us, ((move >> MOVE_PIECE_SHIFT) & 7) - 1, m_from)
+
+        if captured is not None:
+            self.place_piece(them, captured[1], m_to)
+        elif flags & EP_CAPTURE:
+            self.place_piece(them, P, m_to - 8 if us == 0 else m_to + 8)
+
+        return move
+
+    def move_null(self):
+        # pass the turn without moving, for null move pruning in the search
+        if self.ply == len(self.history):
+            self.history.extend([None] * 6 for _ in range(MAX_HISTORY))
+            self.hashes.extend([0] * MAX_HISTORY)
+
+        record = self.history[self.ply]
+        record[0] = 0
+        record[4] = self.ep_square
+        record[5] = self.half_moves
+        self.hashes[self.ply] = self.hash
+        self.ply += 1
+
+        self.hash ^= ZOBRIST_TURN ^ self.ep_hash()
+        self.ep_square = EMPTY
+        # no repetition can reach back past a null move
+        self.half_moves = 0
+        self.turn = BitboardChess.swap_color(self.turn)
+
+    def undo_null(self):
+        self.ply -= 1
+        record = self.history[self.ply]
+
+        self.turn = BitboardChess.swap_color(self.turn)
+        self.ep_square = record[4]
+        self.half_moves = record[5]
+        self.hash = self.hashes[self.ply]
+
+    # utility functions
+
+    @staticmethod
+    def get_san(i):
+        return "abcdefgh"[i & 7] + "12345678"[i >> 3]
+
+    @staticmethod
+    def get_square(san):
+        return (int(san[1]) - 1) * 8 + "abcdefgh".index(san[0])
+
+    @staticmethod
+    def get_bit(san):
+        return 1 << BitboardChess.get_square(san)
+
+    @staticmethod
+    def swap_color(color):
+        return WHITE if color == BLACK else BLACK
+
+    def get_enemy_move(self, fr_from, fr_to):
+        matching_move = None
+
+        for move in self.generate_moves(single_square=fr_from):
+            if BitboardChess.get_san((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK) == fr_to:
+                matching_move = move
+                break
+
+        return matching_move
+
+
+class Move(engine.Move):
+    __slots__ = ()
+
+    def __str__(self):
+        return "{} {} from {} to {}".format(
+            self.color,
+            self.piece,
+            BitboardChess.get_san(self.m_from),
+            BitboardChess.get_san(self.m_to))
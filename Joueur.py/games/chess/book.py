@@ -0,0 +1,110 @@
+import mmap
+import os
+import random
+import struct
+
+# local imports
+from games.chess.constants import *
+
+# Polyglot books are arrays of 16 byte big-endian entries sorted by key: the
+# Zobrist key of the position, the move, its weight and a learning field
+ENTRY = struct.Struct(">QHHI")
+ENTRY_SIZE = ENTRY.size
+KEY = struct.Struct(">Q")
+
+# promotion piece numbers in Polyglot moves, by our type codes
+POLYGLOT_PROMOTIONS = {TYPE_CODES[KNIGHT]: 1, TYPE_CODES[BISHOP]: 2,
+                       TYPE_CODES[ROOK]: 3, TYPE_CODES[QUEEN]: 4}
+
+
+def polyglot_move(game, move):
+    # the Polyglot encoding of one of our packed moves: to file and row in
+    # bits 0-5, from file and row in bits 6-11 and the promotion piece in
+    # bits 12-14, with castling written as the king taking its own rook
+    m_from = game.get_san(move & MOVE_SQUARE_MASK)
+    m_to = game.get_san((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK)
+    flags = move >> MOVE_FLAGS_SHIFT
+
+    if flags & KSIDE_CASTLE:
+        m_to = "h" + m_to[1]
+    elif flags & QSIDE_CASTLE:
+        m_to = "a" + m_to[1]
+
+    return (("abcdefgh".index(m_to[0]) | (int(m_to[1]) - 1) << 3 |
+             "abcdefgh".index(m_from[0]) << 6 | (int(m_from[1]) - 1) << 9) |
+            POLYGLOT_PROMOTIONS.get((move >> MOVE_PROMOTION_SHIFT) & 7, 0) << 12)
+
+
+class OpeningBook:
+    # a Polyglot book read through mmap, so opening one costs the same
+    # whatever its size and probing it only touches the pages a binary
+    # search over the entries lands on
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # an empty file can't be mapped, and has nothing to find anyway
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self.size = size // ENTRY_SIZE
+
+    def close(self):
+        if self.data:
+            self.data.close()
+
+    def find(self, key):
+        # index of the first entry with the key, or where it would be
+        lo = 0
+        hi = self.size
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if KEY.unpack_from(self.data, mid * ENTRY_SIZE)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def entries(self, key):
+        # (Polyglot move, weight) of every entry for the key
+        entries = []
+
+        for i in range(self.find(key), self.size):
+            entry_key, move, weight, _ = ENTRY.unpack_from(self.data, i * ENTRY_SIZE)
+
+            if entry_key != key:
+                break
+
+            entries.append((move, weight))
+
+        return entries
+
+    def probe(self, game, best=False):
+        # one of the book's moves for the position as a legal packed move,
+        # the heaviest if best or else picked at random by weight, or 0 if
+        # the position isn't in the book
+        entries = self.entries(game.hash)
+
+        if not entries:
+            return 0
+
+        # books can list moves they don't want played with no weight
+        if best or not any(weight for _, weight in entries):
+            choice = max(entries, key=lambda entry: entry[1])[0]
+        else:
+            choice = random.choices([move for move, _ in entries],
+                                    [weight for _, weight in entries])[0]
+
+        # only the moves of the piece on its from square can match it
+        m_from = "abcdefgh"[(choice >> 6) & 7] + str((choice >> 9 & 7) + 1)
+
+        for move in game.generate_moves(single_square=m_from):
+            if polyglot_move(game, move) == choice:
+                return move
+
+        # a key collision with a position the move isn't legal in
+        return 0
@@ -1,4 +1,4 @@
-import copy
+from array import array
 
 # local imports
 from games.chess.constants import *
@@ -16,29 +16,40 @@ class Chess:
         KING: "King"
     }
 
-    def __init__(self, fen=DEFAULT_FEN):
-        self.board = [None] * 128
+    def __init__(self, fen=DEFAULT_FEN, debug=False):
+        # piece code of each square (see PIECE_CODES), 0 if empty
+        self.board = bytearray(128)
+        # occupied squares of each color
+        self.squares = {WHITE: set(), BLACK: set()}
         self.kings = {WHITE: EMPTY, BLACK: EMPTY}
         self.castling = {WHITE: 0, BLACK: 0}
-        self.history = []
-        #self.value = 0
+        # preallocated stack of undo records, one per ply
+        self.history = [[None] * 9 for _ in range(MAX_HISTORY)]
+        # hash of the position before each ply, for repetition detection
+        self.hashes = [0] * MAX_HISTORY
+        self.ply = 0
+        # Polyglot compatible Zobrist key of the position
+        self.hash = 0
+        # running material and PST value of the position
+        self.value = 0
+        # check incremental state against a full recompute
+        self.debug = debug
 
         self.load(fen)
 
     def get_value(self):
-        value = 0
+        if self.debug:
+            assert self.value == self.compute_value(), self.generate_fen()
 
-        for square in SQUARES:
-            value += self.get_piece_value(square.value)
+        return self.value
 
-        return value
+    def compute_value(self):
+        value = 0
 
-    def copy(self):
-        new = copy.copy(self)
-        new.kings = {WHITE: self.kings[WHITE], BLACK: self.kings[BLACK]}
-        new.castling = {WHITE: self.castling[WHITE], BLACK: self.castling[BLACK]}
+        for square in self.squares[WHITE] | self.squares[BLACK]:
+            value += self.get_piece_value(square)
 
-        return new
+        return value
 
     def load(self, fen):
         tokens = fen.split()
@@ -51,9 +62,7 @@ class Chess:
                 square += int(piece)
             else:
                 color = WHITE if piece.isupper() else BLACK
-                piece = Piece(piece.lower(), color)
-                self.place_piece(piece, Chess.get_san(square))
-                #self.value += Chess.get_piece_value(color, piece.type, square)
+                self.place_piece(PIECE_CODES[color][piece.lower()], square)
                 square += 1
 
         self.turn = tokens[1]
@@ -71,6 +80,37 @@ class Chess:
         self.half_moves = int(tokens[4])
         self.move_number = int(tokens[5])
 
+        self.hash = self.compute_hash()
+        self.value = self.compute_value()
+
+    def compute_hash(self):
+        key = 0
+
+        for square in self.squares[WHITE] | self.squares[BLACK]:
+            key ^= ZOBRIST_CODES[self.board[square]][square]
+
+        key ^= ZOBRIST_CASTLING[WHITE][self.castling[WHITE]]
+        key ^= ZOBRIST_CASTLING[BLACK][self.castling[BLACK]]
+        key ^= self.ep_hash()
+
+        if self.turn == WHITE:
+            key ^= ZOBRIST_TURN
+
+        return key
+
+    def ep_hash(self):
+        # polyglot only hashes the en passant file if a pawn can capture there
+        if self.ep_square == EMPTY:
+            return 0
+
+        pawn = PIECE_CODES[self.turn][PAWN]
+
+        for square in PAWN_ATTACKERS[self.turn][self.ep_square]:
+            if self.board[square] == pawn:
+                return ZOBRIST_EP[Chess.get_file(self.ep_square)]
+
+        return 0
+
     def generate_fen(self):
         empty = 0
         fen = ""
@@ -85,11 +125,8 @@ class Chess:
                 if empty > 0:
                     fen += str(empty)
                     empty = 0
-                
-                type = self.board[i].type
-                color = self.board[i].color
 
-                fen += type.upper() if color == WHITE else type
+                fen += CODE_SYMBOLS[self.board[i]]
 
             if (i+1) & 0x88:
                 if empty > 0:
@@ -120,15 +157,52 @@ class Chess:
         return ' '.join(
             [fen, self.turn, cflags, epflags, str(self.half_moves), str(self.move_number)])
     
-    def get_piece(square):
-        return self.board[SQUARES[square].value]
+    def get_piece(self, square):
+        piece = self.board[SQUARES[square].value]
+        return PIECES[CODE_COLORS[piece]][CODE_TYPES[piece]] if piece else None
 
-    def place_piece(self, piece, square):
-        sq = SQUARES[square].value
+    def get_move(self, move):
+        return Move(move)
+
+    def last_move(self):
+        # the packed move that led to this position, 0 at the start
+        return self.history[self.ply - 1][0] if self.ply else 0
+
+    def serialize(self):
+        # the FEN from before the last irreversible move and the packed
+        # moves since, which is all it takes to rebuild the position along
+        # with the positions it could still repeat
+        moves = [self.history[ply][0] for ply in range(max(self.ply - self.half_moves, 0), self.ply)]
+
+        for _ in moves:
+            self.undo()
+
+        fen = self.generate_fen()
+
+        for move in moves:
+            self.move(move)
+
+        return fen, array('L', moves).tobytes()
+
+    @classmethod
+    def deserialize(cls, data, debug=False):
+        fen, moves = data
+        game = cls(fen, debug)
+        packed = array('L')
+        packed.frombytes(moves)
+
+        for move in packed:
+            game.move(move)
+
+        return game
+
+    def place_piece(self, piece, sq):
+        color = CODE_COLORS[piece]
         self.board[sq] = piece
+        self.squares[color].add(sq)
 
-        if piece.type == KING:
-            self.kings[piece.color] = sq
+        if CODE_TYPES[piece] == KING:
+            self.kings[color] = sq
 
     def print(self):
         print("   +" + '-'*24 + '+')
@@ -143,10 +217,7 @@ class Chess:
             if not self.board[i]:
                 print(" . ", end='')
             else:
-                type = self.board[i].type
-                color = self.board[i].color
-
-                print(' ' + (type.upper() if color == WHITE else type) + ' ', end='')
+                print(' ' + CODE_SYMBOLS[self.board[i]] + ' ', end='')
 
             if (i+1) & 0x88:
                 print('|')
@@ -155,107 +226,144 @@ class Chess:
         print("   +" + '-'*24 + '+')
         print("     " + "  ".join(list("abcdefgh")))
 
-    def generate_moves(self, legal=True, single_square=""):
+    def generate_moves(self, legal=True, single_square="", captures=None):
+        # captures selects only captures and promotions (True), only quiet
+        # moves (False) or everything (None)
         def add_move(m_from, m_to, flags):
-            moves = []
-
-            if ((Chess.get_rank(m_to) == RANK_8 or Chess.get_rank(m_to) == RANK_1) and
-                    self.board[m_from].type == PAWN):
-                for piece in [QUEEN, ROOK, BISHOP, KNIGHT]:
-                    moves.append(Move(self.board, self.turn, m_from, m_to, flags, piece))
+            piece = board[m_from] & 7
+            promotion = (piece == PAWN_CODE and
+                         (Chess.get_rank(m_to) == RANK_8 or Chess.get_rank(m_to) == RANK_1))
+
+            if captures is not None and captures != bool(promotion or flags & (CAPTURE | EP_CAPTURE)):
+                return
+
+            # en passant captures a pawn that isn't on the to square
+            captured = PAWN_CODE if flags & EP_CAPTURE else board[m_to] & 7
+            move = (m_from | m_to << MOVE_TO_SHIFT |
+                    captured << MOVE_CAPTURED_SHIFT |
+                    piece << MOVE_PIECE_SHIFT |
+                    flags << MOVE_FLAGS_SHIFT | color_bit)
+
+            if legal:
+                if m_from == king:
+                    # make sure the king doesn't walk into (or along) an attack
+                    if not flags & (KSIDE_CASTLE | QSIDE_CASTLE):
+                        board[king] = 0
+                        attacked = self.attacked(them, m_to)
+                        board[king] = king_code
+
+                        if attacked:
+                            return
+                elif flags & EP_CAPTURE:
+                    # en passant can expose the king along the rank, so it's
+                    # tried once we're done walking the piece sets
+                    ep_moves.append(move)
+                    return
+                elif allowed is not None and m_to not in allowed:
+                    return
+
+            if promotion:
+                move |= PROMOTION << MOVE_FLAGS_SHIFT
+
+                for code in PROMOTION_CODES:
+                    moves.append(move | code << MOVE_PROMOTION_SHIFT)
             else:
-                moves.append(Move(self.board, self.turn, m_from, m_to, flags))
-
-            return moves
+                moves.append(move)
 
         moves = []
+        ep_moves = []
+        board = self.board
         us = self.turn
         them = Chess.swap_color(us)
+        them_bit = COLOR_BITS[them]
+        color_bit = MOVE_BLACK if us == BLACK else 0
         second_rank = {'b': RANK_7, 'w': RANK_2}
-
-        i = SQUARES.a8.value - 1
-        last_sq = SQUARES.h1.value
+        pawn_offsets = PAWN_OFFSETS[us]
+        king = self.kings[us]
+        king_code = board[king]
 
         # if we're only exploring the moves for a single square
         if single_square:
-            i = last_sq = SQUARES[single_square].value - 1
+            sq = SQUARES[single_square].value
+            squares = [sq] if sq in self.squares[us] else []
+        else:
+            squares = self.squares[us]
 
-        while i <= last_sq:
-            i += 1
-            # if we ran off the end of the board
-            if i & 0x88:
-                i += 7
-                continue
+        if legal:
+            checkers, evasions, pins = self.checks_and_pins(us)
+
+            # in double check only the king can move
+            if len(checkers) > 1:
+                squares = [king] if king in squares else []
+
+        for i in squares:
+            type = board[i] & 7
 
-            piece = self.board[i]
-            # if empty square or enemy piece
-            if not piece or piece.color != us:
-                continue
+            # destination squares that keep the king safe, if restricted
+            if legal and i != king:
+                allowed = pins.get(i)
 
-            if piece.type == PAWN:
+                if checkers:
+                    allowed = evasions if allowed is None else allowed & evasions
+
+            if type == PAWN_CODE:
                 # single square non-capture
-                square = i + PAWN_OFFSETS[us][0]
+                square = i + pawn_offsets[0]
 
                 # if square is empty
-                if not self.board[square]:
-                    moves += add_move(i, square, NORMAL)
+                if not board[square]:
+                    add_move(i, square, NORMAL)
 
                     # double square
-                    square = i + PAWN_OFFSETS[us][1]
+                    square = i + pawn_offsets[1]
 
-                    if second_rank[us] == Chess.get_rank(i) and not self.board[square]:
-                        moves += add_move(i, square, BIG_PAWN)
+                    if second_rank[us] == Chess.get_rank(i) and not board[square]:
+                        add_move(i, square, BIG_PAWN)
 
                 # pawn captures
                 for j in range(2, 4):
-                    square = i + PAWN_OFFSETS[us][j]
+                    square = i + pawn_offsets[j]
 
                     # if end of board
                     if square & 0x88:
                         continue
 
                     # if square is occupied by enemy piece
-                    if self.board[square] and self.board[square].color == them:
-                        moves += add_move(i, square, CAPTURE)
+                    if board[square] and board[square] & 8 == them_bit:
+                        add_move(i, square, CAPTURE)
                     # if capture square is en passant square
                     elif square == self.ep_square:
-                        moves += add_move(i, square, EP_CAPTURE)
+                        add_move(i, square, EP_CAPTURE)
+            elif type == KNIGHT_CODE or type == KING_CODE:
+                for square in (KNIGHT_TARGETS if type == KNIGHT_CODE else KING_TARGETS)[i]:
+                    if not board[square]:
+                        add_move(i, square, NORMAL)
+                    elif board[square] & 8 == them_bit:
+                        add_move(i, square, CAPTURE)
             else:
-                for offset in PIECE_OFFSETS[piece.type]:
-                    square = i
-
-                    while True:
-                        square += offset
-
-                        # break if end of board
-                        if square & 0x88:
-                            break
-
-                        if not self.board[square]:
-                            moves += add_move(i, square, NORMAL)
+                for ray in SLIDER_RAYS[CODE_TYPES[type]][i]:
+                    for square in ray:
+                        if not board[square]:
+                            add_move(i, square, NORMAL)
                         else:
-                            if self.board[square].color == them:
-                                moves += add_move(i, square, CAPTURE)
+                            if board[square] & 8 == them_bit:
+                                add_move(i, square, CAPTURE)
 
                             break
 
-                        # break if knight or king
-                        if piece.type in ['n', 'k']:
-                            break
-
-        if not single_square or last_sq == self.kings[us]:
+        if captures is not True and (not single_square or squares == [king]):
             # kingside castling
             if self.castling[us] & KSIDE_CASTLE:
                 castling_from = self.kings[us]
                 castling_to = castling_from + 2
 
                 # if the path is clear, we're not in check and won't be in check
-                if (not self.board[castling_from+1] and
-                        not self.board[castling_to] and
+                if (not board[castling_from+1] and
+                        not board[castling_to] and
                         not self.attacked(them, self.kings[us]) and
                         not self.attacked(them, castling_from+1) and
                         not self.attacked(them, castling_to)):
-                    moves += add_move(self.kings[us], castling_to, KSIDE_CASTLE)
+                    add_move(self.kings[us], castling_to, KSIDE_CASTLE)
 
             # queenside castling
             if self.castling[us] & QSIDE_CASTLE:
@@ -263,75 +371,177 @@ class Chess:
                 castling_to = castling_from - 2
 
                 # if the path is clear, we're not in check and won't be in check
-                if (not self.board[castling_from-1] and
-                        not self.board[castling_from-2] and
-                        not self.board[castling_from-3] and
+                if (not board[castling_from-1] and
+                        not board[castling_from-2] and
+                        not board[castling_from-3] and
                         not self.attacked(them, self.kings[us]) and
                         not self.attacked(them, castling_from-1) and
                         not self.attacked(them, castling_to)):
-                    moves += add_move(self.kings[us], castling_to, QSIDE_CASTLE)
-
-        # if we're allowing illegal moves
-        if not legal:
-            return moves
+                    add_move(self.kings[us], castling_to, QSIDE_CASTLE)
 
-        # filter out illegal moves
-        legal_moves = []
-        for move in moves:
+        for move in ep_moves:
             self.move(move)
 
             if not self.king_attacked(us):
-                legal_moves.append(move)
+                moves.append(move)
 
             self.undo()
 
-        return legal_moves
+        return moves
 
-    def attacked(self, color, square):
-        i = SQUARES.a8.value - 1
-        while i <= SQUARES.h1.value:
-            i += 1
+    def checks_and_pins(self, color):
+        # find the pieces giving check to color's king (and the squares that
+        # would capture or block them), and color's pieces pinned to its king
+        # (along with the squares they can still move to)
+        board = self.board
+        king = self.kings[color]
+        them = Chess.swap_color(color)
+        codes = PIECE_CODES[them]
+        own_bit = COLOR_BITS[color]
 
-            # if we ran off the end of the board
-            if i & 0x88:
-                i += 7
-                continue
-            
-            # if empty square or wrong color
-            if not self.board[i] or self.board[i].color != color:
-                continue
-
-            piece = self.board[i]
-            difference = i - square
-            index = difference + 119
-
-            if ATTACKS[index] & (1 << SHIFTS[piece.type]):
-                if piece.type == PAWN:
-                    if difference > 0:
-                        if piece.color == WHITE:
-                            return True
-                    else:
-                        if piece.color == BLACK:
-                            return True
-                    continue
-
-                # if knight or king
-                if piece.type in ['n', 'k']:
-                    return True
+        checkers = []
+        evasions = set()
+        pins = {}
+
+        for square in KNIGHT_TARGETS[king]:
+            if board[square] == codes[KNIGHT]:
+                checkers.append(square)
+                evasions.add(square)
+
+        for square in PAWN_ATTACKERS[them][king]:
+            if board[square] == codes[PAWN]:
+                checkers.append(square)
+                evasions.add(square)
+
+        for type in (ROOK, BISHOP):
+            sliders = (codes[type], codes[QUEEN])
+
+            for ray in SLIDER_RAYS[type][king]:
+                pinned = None
+
+                for n, square in enumerate(ray):
+                    piece = board[square]
 
+                    if not piece:
+                        continue
+
+                    # first of our own pieces along the ray might be pinned
+                    if piece & 8 == own_bit:
+                        if pinned is not None:
+                            break
+
+                        pinned = square
+                        continue
+
+                    if piece in sliders:
+                        if pinned is None:
+                            checkers.append(square)
+                            evasions.update(ray[:n+1])
+                        else:
+                            pins[pinned] = set(ray[:n+1])
+
+                    break
+
+        return checkers, evasions, pins
+
+    def gives_check(self, move):
+        # special moves are rare, so just try them
+        if (move >> MOVE_FLAGS_SHIFT) & (EP_CAPTURE | KSIDE_CASTLE | QSIDE_CASTLE):
+            self.move(move)
+            check = self.in_check()
+            self.undo()
+
+            return check
+
+        board = self.board
+        us = self.turn
+        king = self.kings[Chess.swap_color(us)]
+        m_from = move & MOVE_SQUARE_MASK
+        m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        type = CODE_TYPES[(move >> MOVE_PROMOTION_SHIFT) & 7 or (move >> MOVE_PIECE_SHIFT) & 7]
+
+        # direct check from the moved piece
+        index = m_to - king + 119
+
+        if ATTACKS[index] & (1 << SHIFTS[type]):
+            if type == PAWN:
+                # pawns only attack forwards
+                if (m_to > king) == (us == WHITE):
+                    return True
+            elif type == KNIGHT:
+                return True
+            else:
                 offset = RAYS[index]
-                j = i + offset
+                square = m_to + offset
 
-                blocked = False
-                while j != square:
-                    if self.board[j]:
-                        blocked = True
+                while square != king:
+                    if board[square] and square != m_from:
                         break
-                    j += offset
 
-                if not blocked:
+                    square += offset
+                else:
                     return True
 
+        # discovered check from a slider the moved piece was blocking
+        index = m_from - king + 119
+
+        if ATTACKS[index] & (1 << SHIFTS[QUEEN]):
+            offset = -RAYS[index]
+
+            # moving along the same line keeps it blocked
+            if m_to != king and RAYS[m_to - king + 119] == RAYS[index]:
+                return False
+
+            sliders = PIECE_CODES[us][ROOK if offset in (-16, -1, 1, 16) else BISHOP]
+            queen = PIECE_CODES[us][QUEEN]
+            square = king + offset
+
+            while not square & 0x88:
+                if board[square] and square != m_from:
+                    return board[square] == sliders or board[square] == queen
+
+                square += offset
+
+        return False
+
+    def attacked(self, color, square):
+        # work backwards from the square to any pieces of color that could reach it
+        board = self.board
+        codes = PIECE_CODES[color]
+
+        knight = codes[KNIGHT]
+        for i in KNIGHT_TARGETS[square]:
+            if board[i] == knight:
+                return True
+
+        king = codes[KING]
+        for i in KING_TARGETS[square]:
+            if board[i] == king:
+                return True
+
+        pawn = codes[PAWN]
+        for i in PAWN_ATTACKERS[color][square]:
+            if board[i] == pawn:
+                return True
+
+        queen = codes[QUEEN]
+
+        rook = codes[ROOK]
+        for ray in SLIDER_RAYS[ROOK][square]:
+            for i in ray:
+                if board[i]:
+                    if board[i] == rook or board[i] == queen:
+                        return True
+                    break
+
+        bishop = codes[BISHOP]
+        for ray in SLIDER_RAYS[BISHOP][square]:
+            for i in ray:
+                if board[i]:
+                    if board[i] == bishop or board[i] == queen:
+                        return True
+                    break
+
         return False
 
     def king_attacked(self, color):
@@ -346,66 +556,73 @@ class Chess:
     def in_stalemate(self):
         return not self.in_check() and not self.generate_moves()
 
-    def insufficient_material(self):
-        pieces = {}
-        bishops = []
-        num_pieces = 0
-        sq_color = 0
-
-        i = SQUARES.a8.value - 1
-        while i <= SQUARES.h1.value:
-            i += 1
-            sq_color = (sq_color + 1) % 2
-
-            if i & 0x88:
-                i += 7
-                continue
+    def non_pawn_material(self):
+        # value of the side to move's knights, bishops, rooks and queens
+        board = self.board
+        return sum(PIECE_VALUES[CODE_TYPES[board[square]]] for square in self.squares[self.turn]
+                   if board[square] & 7 not in (PAWN_CODE, KING_CODE))
 
-            piece = self.board[i]
+    def piece_count(self):
+        return len(self.squares[WHITE]) + len(self.squares[BLACK])
 
-            if piece:
-                pieces[piece.type] = pieces.get(piece.type, 0) + 1
+    def piece_list(self):
+        # (color, type, square) of every piece, with squares numbered from
+        # a1 = 0 to h8 = 63 as the bitboard backend does
+        return [(CODE_COLORS[self.board[square]], CODE_TYPES[self.board[square]],
+                 (7 - Chess.get_rank(square)) * 8 + Chess.get_file(square))
+                for square in self.squares[WHITE] | self.squares[BLACK]]
 
-                if piece.type == BISHOP:
-                    bishops.append(sq_color)
-
-                num_pieces += 1
+    def insufficient_material(self):
+        num_pieces = len(self.squares[WHITE]) + len(self.squares[BLACK])
 
         # K vs. K
         if num_pieces == 2:
             return True
+
+        pieces = {}
+        bishops = []
+
+        for square in self.squares[WHITE] | self.squares[BLACK]:
+            type = CODE_TYPES[self.board[square]]
+            pieces[type] = pieces.get(type, 0) + 1
+
+            if type == BISHOP:
+                bishops.append((Chess.get_rank(square) + Chess.get_file(square)) % 2)
+
         # K vs. KN or K vs. KB
-        elif num_pieces == 3 and (pieces.get(BISHOP, 0) == 1 or pieces.get(KNIGHT, 0) == 1):
+        if num_pieces == 3 and (pieces.get(BISHOP, 0) == 1 or pieces.get(KNIGHT, 0) == 1):
             return True
         # KB vs. KB where any number of bishops are all the same color
         elif num_pieces == (pieces.get(BISHOP, 0)+2):
             b_sum = sum(bishops)
 
-            if sum == 0 or sum == len(bishops):
+            if b_sum == 0 or b_sum == len(bishops):
                 return True
 
         return False
 
-    def in_threefold_repetition(self):
-        # if we don't have enough moves to determine repetition
-        if len(self.history) < 8:
-            return False
-
-        # if there's been a capture, promotion or pawn movement in the past 8 moves
-        for _, move in self.history[-8:]:
-            if move.captured or move.promotion or move.piece == PAWN:
-                return False
+    def in_threefold_repetition(self, root_ply=None):
+        # compare hashes of earlier positions with the same side to move, as
+        # far back as the last capture or pawn move (none before it can recur)
+        hashes = self.hashes
+        key = self.hash
+        count = 0
+
+        for i in range(self.ply - 4, max(self.ply - self.half_moves, 0) - 1, -2):
+            if hashes[i] == key:
+                # within the search a single repetition is as good as a draw
+                if root_ply is not None and i >= root_ply:
+                    return True
 
-        # if each player's past 2 pairs of moves are not equal
-        for i, j in zip(range(-8, -4), range(-4, 0)):
-            if self.history[i][1] != self.history[j][1]:
-                return False
+                count += 1
+                if count == 2:
+                    return True
 
-        return True
+        return False
 
-    def in_draw(self):
+    def in_draw(self, root_ply=None):
         return (self.half_moves >= 100 or
-                self.in_threefold_repetition() or
+                self.in_threefold_repetition(root_ply) or
                 self.insufficient_material())# or
                 #self.in_stalemate())
 
@@ -415,46 +632,85 @@ class Chess:
     def move(self, move):
         us = self.turn
         them = Chess.swap_color(us)
-        self.snapshot(move)
+        board = self.board
+        squares_us = self.squares[us]
+        m_from = move & MOVE_SQUARE_MASK
+        m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        flags = move >> MOVE_FLAGS_SHIFT
+        piece = board[m_from]
+        captured = board[m_to]
+
+        # grow the undo stack if the game outlasts it
+        if self.ply == len(self.history):
+            self.history.extend([None] * 9 for _ in range(MAX_HISTORY))
+            self.hashes.extend([0] * MAX_HISTORY)
+
+        # save only what can't be recovered from the move itself
+        record = self.history[self.ply]
+        record[0] = move
+        record[1] = captured
+        record[2] = self.castling[WHITE]
+        record[3] = self.castling[BLACK]
+        record[4] = self.ep_square
+        record[5] = self.half_moves
+        record[6] = self.kings[WHITE]
+        record[7] = self.kings[BLACK]
+        record[8] = self.value
+        self.hashes[self.ply] = self.hash
+        self.ply += 1
+
+        key = self.hash ^ ZOBRIST_TURN
+
+        if self.ep_square != EMPTY:
+            key ^= self.ep_hash()
+
+        # if pawn promotion, replace with new piece
+        placed = (move >> MOVE_PROMOTION_SHIFT) & 7 | COLOR_BITS[us] if flags & PROMOTION else piece
+
+        key ^= ZOBRIST_CODES[piece][m_from] ^ ZOBRIST_CODES[placed][m_to]
+        value = self.value - VALUE_CODES[piece][m_from] + VALUE_CODES[placed][m_to]
 
         # if capture, subtract value of piece
-        #self.value -= Chess.PIECE_VALUES[them].get(move.captured, 0)
-        #self.value -= Chess.get_piece_value(them, move.captured, move.m_to)
+        if captured:
+            key ^= ZOBRIST_CODES[captured][m_to]
+            value -= VALUE_CODES[captured][m_to]
+            self.squares[them].remove(m_to)
 
-        self.board[move.m_to] = self.board[move.m_from]
-        self.board[move.m_from] = None
+        board[m_to] = placed
+        board[m_from] = 0
+        squares_us.remove(m_from)
+        squares_us.add(m_to)
 
         # if en passant capture, remove the captured pawn
-        if move.flags & EP_CAPTURE:
-            if self.turn == BLACK:
-                self.board[move.m_to-16] = None
-            else:
-                self.board[move.m_to+16] = None
+        if flags & EP_CAPTURE:
+            ep_pawn = m_to - 16 if us == BLACK else m_to + 16
+            captured = board[ep_pawn]
 
-        # if pawn promotion, replace with new piece
-        if move.flags & PROMOTION:
-            #self.value -= Chess.PIECE_VALUES[self.turn]['p']
-            #self.value += Chess.PIECE_VALUES[self.turn][move.promotion]
-
-            self.board[move.m_to] = Piece(move.promotion, us)
+            board[ep_pawn] = 0
+            self.squares[them].remove(ep_pawn)
+            key ^= ZOBRIST_CODES[captured][ep_pawn]
+            value -= VALUE_CODES[captured][ep_pawn]
 
         # if we moved the king
-        if self.board[move.m_to].type == KING:
-            self.kings[self.board[move.m_to].color] = move.m_to
+        if piece & 7 == KING_CODE:
+            self.kings[us] = m_to
 
             # if we castled, move the rook next to the king
-            if move.flags & KSIDE_CASTLE:
-                castling_to = move.m_to - 1
-                castling_from = move.m_to + 1
-
-                self.board[castling_to] = self.board[castling_from]
-                self.board[castling_from] = None
-            elif move.flags & QSIDE_CASTLE:
-                castling_to = move.m_to + 1
-                castling_from = move.m_to - 2
-
-                self.board[castling_to] = self.board[castling_from]
-                self.board[castling_from] = None
+            if flags & (KSIDE_CASTLE | QSIDE_CASTLE):
+                if flags & KSIDE_CASTLE:
+                    castling_to = m_to - 1
+                    castling_from = m_to + 1
+                else:
+                    castling_to = m_to + 1
+                    castling_from = m_to - 2
+
+                rook = board[castling_from]
+                board[castling_to] = rook
+                board[castling_from] = 0
+                squares_us.remove(castling_from)
+                squares_us.add(castling_to)
+                key ^= ZOBRIST_CODES[rook][castling_from] ^ ZOBRIST_CODES[rook][castling_to]
+                value += VALUE_CODES[rook][castling_to] - VALUE_CODES[rook][castling_from]
 
             # remove castling permissions
             self.castling[us] = 0
@@ -462,88 +718,141 @@ class Chess:
         # remove castling permissions if we move a rook
         if self.castling[us]:
             for rook in ROOKS[us]:
-                if move.m_from == rook["square"] and self.castling[us] & rook["flag"]:
+                if m_from == rook["square"] and self.castling[us] & rook["flag"]:
                     self.castling[us] ^= rook["flag"]
                     break
 
         # remove castling permissions if we capture a rook
         if self.castling[them]:
             for rook in ROOKS[them]:
-                if move.m_to == rook["square"] and self.castling[them] & rook["flag"]:
+                if m_to == rook["square"] and self.castling[them] & rook["flag"]:
                     self.castling[them] ^= rook["flag"]
                     break
 
         # if big pawn move, update the en passant square
-        if move.flags & BIG_PAWN:
-            if self.turn == BLACK:
-                self.ep_square = move.m_to - 16
+        if flags & BIG_PAWN:
+            if us == BLACK:
+                self.ep_square = m_to - 16
             else:
-                self.ep_square = move.m_to + 16
+                self.ep_square = m_to + 16
         else:
             self.ep_square = EMPTY
 
         # reset the 50 move counter if a pawn is moved or a piece is captured
-        if move.piece == PAWN or move.flags & (CAPTURE | EP_CAPTURE):
+        if piece & 7 == PAWN_CODE or captured:
             self.half_moves = 0
         else:
             self.half_moves += 1
 
-        if self.turn == BLACK:
+        if us == BLACK:
             self.move_number += 1
 
-        self.turn = Chess.swap_color(self.turn)
+        self.turn = them
+
+        # update castling and en passant keys now that the new state is known
+        if self.castling[WHITE] != record[2]:
+            key ^= ZOBRIST_CASTLING[WHITE][record[2]] ^ ZOBRIST_CASTLING[WHITE][self.castling[WHITE]]
+        if self.castling[BLACK] != record[3]:
+            key ^= ZOBRIST_CASTLING[BLACK][record[3]] ^ ZOBRIST_CASTLING[BLACK][self.castling[BLACK]]
+
+        if self.ep_square != EMPTY:
+            key ^= self.ep_hash()
+
+        self.hash = key
+        self.value = value
 
     def undo(self):
-        try:
-            old, move = self.history.pop()
         # stack is empty
-        except IndexError:
+        if not self.ply:
             return None
 
-        self.kings = old.kings
-        self.turn = old.turn
-        self.castling = old.castling
-        self.ep_square = old.ep_square
-        self.half_moves = old.half_moves
-        self.move_number = old.move_number
-        #self.value = old.value
-
-        us = self.turn
-        them = Chess.swap_color(us)
-
-        self.board[move.m_from] = self.board[move.m_to]
-        self.board[move.m_from].type = move.piece # undo any promotions
-        self.board[move.m_to] = None
+        self.ply -= 1
+        (move, captured, castling_white, castling_black,
+            ep_square, half_moves, king_white, king_black, value) = self.history[self.ply]
+
+        them = self.turn
+        us = Chess.swap_color(them)
+        board = self.board
+        squares_us = self.squares[us]
+        m_from = move & MOVE_SQUARE_MASK
+        m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        flags = move >> MOVE_FLAGS_SHIFT
+
+        self.turn = us
+        self.castling[WHITE] = castling_white
+        self.castling[BLACK] = castling_black
+        self.ep_square = ep_square
+        self.half_moves = half_moves
+        self.kings[WHITE] = king_white
+        self.kings[BLACK] = king_black
+        self.hash = self.hashes[self.ply]
+        self.value = value
+
+        if us == BLACK:
+            self.move_number -= 1
+
+        # undo any promotions
+        if flags & PROMOTION:
+            board[m_from] = PIECE_CODES[us][PAWN]
+        else:
+            board[m_from] = board[m_to]
 
-        if move.flags & CAPTURE:
-            self.board[move.m_to] = Piece(move.captured, them)
-        elif move.flags & EP_CAPTURE:
-            index = 0
+        board[m_to] = captured
+        squares_us.remove(m_to)
+        squares_us.add(m_from)
 
-            if us == BLACK:
-                index = move.m_to - 16
-            else:
-                index = move.m_to + 16
+        if captured:
+            self.squares[them].add(m_to)
+        elif flags & EP_CAPTURE:
+            ep_pawn = m_to - 16 if us == BLACK else m_to + 16
 
-            self.board[index] = Piece(PAWN, them)
+            board[ep_pawn] = PIECE_CODES[them][PAWN]
+            self.squares[them].add(ep_pawn)
 
-        if move.flags & (KSIDE_CASTLE | QSIDE_CASTLE):
+        if flags & (KSIDE_CASTLE | QSIDE_CASTLE):
             castling_to = castling_from = 0
 
-            if move.flags & KSIDE_CASTLE:
-                castling_to = move.m_to + 1
-                castling_from = move.m_to -1
-            elif move.flags & QSIDE_CASTLE:
-                castling_to = move.m_to - 2
-                castling_from = move.m_to + 1
+            if flags & KSIDE_CASTLE:
+                castling_to = m_to + 1
+                castling_from = m_to -1
+            elif flags & QSIDE_CASTLE:
+                castling_to = m_to - 2
+                castling_from = m_to + 1
 
-            self.board[castling_to] = self.board[castling_from]
-            self.board[castling_from] = None
+            board[castling_to] = board[castling_from]
+            board[castling_from] = 0
+            squares_us.remove(castling_from)
+            squares_us.add(castling_to)
 
         return move
 
-    def snapshot(self, move):
-        self.history.append((self.copy(), move))
+    def move_null(self):
+        # pass the turn without moving, for null move pruning in the search
+        if self.ply == len(self.history):
+            self.history.extend([None] * 9 for _ in range(MAX_HISTORY))
+            self.hashes.extend([0] * MAX_HISTORY)
+
+        record = self.history[self.ply]
+        record[0] = 0
+        record[4] = self.ep_square
+        record[5] = self.half_moves
+        self.hashes[self.ply] = self.hash
+        self.ply += 1
+
+        self.hash ^= ZOBRIST_TURN ^ self.ep_hash()
+        self.ep_square = EMPTY
+        # no repetition can reach back past a null move
+        self.half_moves = 0
+        self.turn = Chess.swap_color(self.turn)
+
+    def undo_null(self):
+        self.ply -= 1
+        record = self.history[self.ply]
+
+        self.turn = Chess.swap_color(self.turn)
+        self.ep_square = record[4]
+        self.half_moves = record[5]
+        self.hash = self.hashes[self.ply]
 
     # utility functions
 
@@ -567,8 +876,8 @@ class Chess:
         matching_move = None
 
         for move in self.generate_moves():
-            if (Chess.get_san(move.m_from) == fr_from and
-                    Chess.get_san(move.m_to) == fr_to):
+            if (Chess.get_san(move & MOVE_SQUARE_MASK) == fr_from and
+                    Chess.get_san((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK) == fr_to):
                 matching_move = move
                 break
 
@@ -580,8 +889,8 @@ class Chess:
         if not piece:
             return 0
 
-        color = piece.color
-        type = piece.type
+        color = CODE_COLORS[piece]
+        type = CODE_TYPES[piece]
 
         # add material and PST heuristic value
         value = PIECE_VALUES[type] + PST_VALUES[color][type][square]
@@ -595,23 +904,24 @@ class Piece:
         self.color = color
 
 
+# shared read-only piece views for get_piece
+PIECES = {color: {type: Piece(type, color) for type in Chess.PIECE_MAP}
+          for color in (WHITE, BLACK)}
+
+
 class Move:
-    def __init__(self, board, color, m_from, m_to, flags, promotion=''):
-        self.color = color
-        self.m_from = m_from
-        self.m_to = m_to
-        self.flags = flags
-        self.promotion = promotion
-        self.piece = board[m_from].type
-        self.captured = ''
-        
-        if promotion:
-            self.flags |= PROMOTION
-
-        if board[m_to]:
-            self.captured = board[m_to].type
-        elif flags & EP_CAPTURE:
-            self.captured = PAWN
+    # read-only view of a packed move, for the framework and printing
+    __slots__ = ('move', 'color', 'm_from', 'm_to', 'flags', 'promotion', 'piece', 'captured')
+
+    def __init__(self, move):
+        self.move = move
+        self.color = BLACK if move & MOVE_BLACK else WHITE
+        self.m_from = move & MOVE_SQUARE_MASK
+        self.m_to = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        self.flags = move >> MOVE_FLAGS_SHIFT
+        self.promotion = CODE_TYPES[(move >> MOVE_PROMOTION_SHIFT) & 7]
+        self.piece = CODE_TYPES[(move >> MOVE_PIECE_SHIFT) & 7]
+        self.captured = CODE_TYPES[(move >> MOVE_CAPTURED_SHIFT) & 7]
 
     def __eq__(self, other):
         return self.m_from == other.m_from and self.m_to == other.m_to
@@ -0,0 +1,150 @@
+from array import array
+
+# local imports
+from games.chess.constants import *
+
+# material values indexed by the piece type codes packed into moves
+CODE_VALUES = [PIECE_VALUES.get(type, 0) for type in CODE_TYPES[:8]]
+
+# history is indexed by the color, from and to squares of a move
+HISTORY_SIZE = 1 << 15
+# countermoves are indexed by the color, piece and to square of the move
+# they answer
+COUNTER_SIZE = 1 << 11
+# all history scores are halved once one of them gets past this
+HISTORY_LIMIT = 1 << 24
+
+
+def history_index(move):
+    return (move & 0x3FFF) | ((move >> 16) & 0x4000)
+
+
+def counter_index(move):
+    return ((((move >> MOVE_PIECE_SHIFT) & 7) | ((move >> 27) & 8)) << 7 |
+            ((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK))
+
+
+def capture_order(move):
+    # most valuable victim first, then least valuable attacker
+    return ((move >> MOVE_CAPTURED_SHIFT) & 7) * 8 - ((move >> MOVE_PIECE_SHIFT) & 7)
+
+
+def losing_capture(game, move):
+    # a bigger piece taking a defended smaller one (without promoting)
+    return (not move & MOVE_PROMOTION_MASK and
+            CODE_VALUES[(move >> MOVE_PIECE_SHIFT) & 7] >
+            CODE_VALUES[(move >> MOVE_CAPTURED_SHIFT) & 7] and
+            game.attacked(WHITE if move & MOVE_BLACK else BLACK,
+                          (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK))
+
+
+def find_move(game, key, captures_only=False):
+    # the legal move matching a stored move key, checked against the moves
+    # of the piece on its from square since the key might be from a
+    # different position with the same hash
+    for move in game.generate_moves(single_square=game.get_san(key & MOVE_SQUARE_MASK),
+                                    captures=True if captures_only else None):
+        if move & MOVE_KEY_MASK == key:
+            return move
+
+    return 0
+
+
+class MoveOrdering:
+    # what the search has learned about which quiet moves cut off: two
+    # killers per ply, a butterfly history of cutoffs by depth, and the
+    # reply that last refuted each move
+
+    def __init__(self):
+        self.killers = array('L', [0]) * (MAX_PLY * 2)
+        self.history = array('L', [0]) * HISTORY_SIZE
+        self.counters = array('L', [0]) * COUNTER_SIZE
+
+    def new_search(self):
+        # killers were found in other positions, and older history should
+        # count for less than what this search finds
+        self.killers = array('L', [0]) * (MAX_PLY * 2)
+        self.age_history()
+
+    def age_history(self):
+        self.history = array('L', (score >> 1 for score in self.history))
+
+    def get_killers(self, ply):
+        return self.killers[ply * 2:ply * 2 + 2]
+
+    def get_counter(self, last_move):
+        return self.counters[counter_index(last_move)] if last_move else 0
+
+    def cutoff(self, move, ply, depth, last_move):
+        # captures and promotions are tried early anyway
+        if move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK):
+            return
+
+        i = ply * 2
+        if self.killers[i] != move:
+            self.killers[i + 1] = self.killers[i]
+            self.killers[i] = move
+
+        i = history_index(move)
+        self.history[i] += depth * depth
+        if self.history[i] > HISTORY_LIMIT:
+            self.age_history()
+
+        if last_move:
+            self.counters[counter_index(last_move)] = move
+
+
+def pick_moves(game, hash_move=0, killers=(), counter=0, history=None, captures_only=False):
+    # yield the legal moves of the position in stages, only generating the
+    # moves of a stage once the previous ones failed to cut off: the hash
+    # move, winning captures, promotions, killers, the countermove, quiet
+    # moves by history and then losing captures (captures_only skips the
+    # killers, countermove and quiet moves)
+    tried = []
+
+    # hash move
+    if hash_move:
+        move = find_move(game, hash_move, captures_only)
+
+        if move:
+            tried.append(move)
+            yield move
+
+    # captures and promotions
+    captures = []
+    promotions = []
+    losing = []
+
+    for move in game.generate_moves(captures=True):
+        if move in tried:
+            continue
+
+        if not move & MOVE_CAPTURED_MASK:
+            promotions.append(move)
+        elif losing_capture(game, move):
+            losing.append(move)
+        else:
+            captures.append(move)
+
+    captures.sort(key=capture_order, reverse=True)
+    yield from captures
+    yield from promotions
+
+    if not captures_only:
+        quiets = game.generate_moves(captures=False)
+
+        # killers and the countermove if they're quiet moves in this position
+        for killer in (*killers, counter):
+            if killer and killer not in tried and killer in quiets:
+                tried.append(killer)
+                yield killer
+
+        if history is not None:
+            quiets.sort(key=lambda move: history[history_index(move)], reverse=True)
+
+        for move in quiets:
+            if move not in tried:
+                yield move
+
+    losing.sort(key=capture_order, reverse=True)
+    yield from losing
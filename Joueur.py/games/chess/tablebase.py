@@ -0,0 +1,199 @@
+import mmap
+import os
+
+# local imports
+from games.chess.constants import *
+
+# tables hold a byte per position, all those with white to move and then
+# all those with black to move: DRAW, ILLEGAL for positions that can't
+# arise, or else one more than the plies to mate, which the side to move
+# wins if they're odd and loses if they're even (so 1 is checkmated)
+DRAW = 0
+ILLEGAL = 255
+TABLE_EXTENSION = ".tb"
+
+# most pieces (kings included) in any table
+MAX_PIECES = 4
+
+# the pieces of a side in the order they're named and indexed
+PIECE_ORDER = (KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+
+
+def _transform(sq, t):
+    # one of the 8 symmetries of the board (squares numbered a1 = 0 to
+    # h8 = 63): mirroring the files, the ranks, and across the a1-h8 diagonal
+    file = sq & 7
+    rank = sq >> 3
+
+    if t & 1:
+        file = 7 - file
+    if t & 2:
+        rank = 7 - rank
+    if t & 4:
+        file, rank = rank, file
+
+    return rank * 8 + file
+
+TRANSFORMS = [[_transform(sq, t) for sq in range(64)] for t in range(8)]
+
+
+def _king_squares(pawns):
+    # the squares the white king is moved onto by symmetry (the a1-d1-d4
+    # triangle, or just the a-d files since pawns can't be turned around),
+    # the transforms that take each square there (two for the squares that
+    # end up on the diagonal) and the index of each square there
+    transforms = (0, 1) if pawns else range(8)
+    region = [sq for sq in range(64) if (sq & 7) < 4 and (pawns or (sq >> 3) <= (sq & 7))]
+    region_index = {sq: i for i, sq in enumerate(region)}
+    king_transforms = [[t for t in transforms if TRANSFORMS[t][sq] in region_index] for sq in range(64)]
+
+    return region, king_transforms, [region_index.get(sq, -1) for sq in range(64)]
+
+KING_SQUARES = {pawns: _king_squares(pawns) for pawns in (False, True)}
+
+
+def side_name(types):
+    # e.g. "KRP" for a king, rook and pawn
+    return "".join(sorted(types, key=PIECE_ORDER.index)).upper()
+
+
+def _strength(name):
+    # stronger sides have more material, or else better pieces
+    return (sum(PIECE_VALUES[type.lower()] for type in name),
+            [-PIECE_ORDER.index(type.lower()) for type in name])
+
+
+def table_name(white, black):
+    # the name of the table covering a position with these sides, and
+    # whether the colors have to be swapped to look it up, since each table
+    # has the stronger side as white
+    if _strength(black) > _strength(white):
+        return "{}v{}".format(black, white), True
+
+    return "{}v{}".format(white, black), False
+
+
+def table_names(max_pieces=MAX_PIECES):
+    # every table with a piece or two besides the kings, fewest pieces and
+    # then fewest pawns first, so the tables a capture or promotion leads to
+    # always come before the ones it's made in
+    types = PIECE_ORDER[1:]
+    names = set()
+
+    for first in range(len(types)):
+        names.add(table_name("K" + side_name(types[first]), "K")[0])
+
+        if max_pieces > 3:
+            for second in range(first, len(types)):
+                names.add(table_name("K" + side_name(types[first] + types[second]), "K")[0])
+                names.add(table_name("K" + side_name(types[first]), "K" + side_name(types[second]))[0])
+
+    return sorted(names, key=lambda name: (len(name), name.count("P"), name))
+
+
+class Table:
+    # how the positions of one table are indexed: the white king (moved by
+    # symmetry onto its region of the board), then each other piece's
+    # square, white's and then black's in PIECE_ORDER
+
+    def __init__(self, name):
+        self.name = name
+        white, black = name.split("v")
+        self.pieces = ([(WHITE, type.lower()) for type in white] +
+                       [(BLACK, type.lower()) for type in black])
+        self.pawns = "P" in name
+        self.region, self.king_transforms, self.king_index = KING_SQUARES[self.pawns]
+        # positions with each side to move
+        self.size = len(self.region) * 64 ** (len(self.pieces) - 1)
+
+    def index(self, squares, turn):
+        # the lowest index of any of the position's symmetries, so every
+        # one of them has the same index
+        best = None
+
+        for transform in self.king_transforms[squares[0]]:
+            mapped = TRANSFORMS[transform]
+            index = self.king_index[mapped[squares[0]]]
+
+            for sq in squares[1:]:
+                index = index * 64 + mapped[sq]
+
+            if best is None or index < best:
+                best = index
+
+        return best + self.size if turn == BLACK else best
+
+    def squares(self, index):
+        # the side to move and the squares of the pieces of a position
+        turn = BLACK if index >= self.size else WHITE
+        index %= self.size
+        squares = []
+
+        for _ in range(len(self.pieces) - 1):
+            squares.append(index & 63)
+            index >>= 6
+
+        squares.append(self.region[index])
+        squares.reverse()
+
+        return turn, squares
+
+
+class Tablebases:
+    # the tables in a directory, each mapped with mmap the first time it's
+    # probed, so a probe is an index computation and a single byte read
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.names = {name[:-len(TABLE_EXTENSION)] for name in os.listdir(directory)
+                      if name.endswith(TABLE_EXTENSION)}
+        self.max_pieces = max((len(name) - 1 for name in self.names), default=2)
+        self.tables = {}
+
+    def close(self):
+        for table, data in self.tables.values():
+            data.close()
+
+        self.tables = {}
+
+    def open(self, name):
+        with open(os.path.join(self.directory, name + TABLE_EXTENSION), "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.tables[name] = (Table(name), data)
+        return self.tables[name]
+
+    def probe(self, game):
+        # the table value of the position, or None if there's no table for
+        # it, or castling or en passant (which the tables leave out) are
+        # still possible
+        if game.piece_count() > self.max_pieces or game.ep_hash():
+            return None
+
+        castling = game.castling
+        if any(castling.values() if isinstance(castling, dict) else castling):
+            return None
+
+        pieces = game.piece_list()
+
+        # bare kings
+        if len(pieces) == 2:
+            return DRAW
+
+        name, swap = table_name(side_name(type for color, type, sq in pieces if color == WHITE),
+                                side_name(type for color, type, sq in pieces if color == BLACK))
+
+        if name not in self.names:
+            return None
+
+        table, data = self.tables.get(name) or self.open(name)
+
+        # with the colors swapped, the board is turned around as well
+        if swap:
+            pieces = [(BLACK if color == WHITE else WHITE, type, sq ^ 56) for color, type, sq in pieces]
+
+        pieces.sort(key=lambda piece: (piece[0] != WHITE, PIECE_ORDER.index(piece[1])))
+        turn = game.turn if not swap else BLACK if game.turn == WHITE else WHITE
+        value = data[table.index([sq for color, type, sq in pieces], turn)]
+
+        return value if value != ILLEGAL else None
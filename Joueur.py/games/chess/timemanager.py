@@ -0,0 +1,108 @@
+from timeit import default_timer
+
+# local imports
+from games.chess.constants import *
+
+# weights of the non-pawn pieces for the game phase, 24 at the start
+PHASE_WEIGHTS = {KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4}
+PHASE_TOTAL = 24
+
+
+def game_phase(game):
+    # 1.0 with all pieces on the board down to 0.0 with only kings and pawns
+    board = game.generate_fen().split()[0].lower()
+    phase = sum(PHASE_WEIGHTS.get(symbol, 0) for symbol in board)
+
+    return min(phase, PHASE_TOTAL) / PHASE_TOTAL
+
+
+class TimeManager:
+    # splits the clock into a soft budget per move, which the search won't
+    # start another iteration after, and a hard one it's aborted at
+
+    def __init__(self, reserve_ms=500, rtt_factor=3, moves_to_go_min=20, moves_to_go_max=45,
+                 hard_ratio=4, max_share=0.2, instability=0.5):
+        # time always kept back, in ms
+        self.reserve = reserve_ms / 1000
+        # multiple of the measured network round trip kept back as well
+        self.rtt_factor = rtt_factor
+        # moves we expect to still have to make, late and early in the game
+        self.moves_to_go_min = moves_to_go_min
+        self.moves_to_go_max = moves_to_go_max
+        # hard budget as a multiple of the soft one
+        self.hard_ratio = hard_ratio
+        # most of the usable time any one move can take
+        self.max_share = max_share
+        # how much more of the soft budget to use when the search is unsure
+        self.instability = instability
+
+        # estimated round trip to the server in seconds, from how much more
+        # it charges us than we measure
+        self.rtt = 0
+        self.last_remaining = None
+        self.last_elapsed = 0
+
+        self.start_time = 0
+        # time already spent searching this move before the turn started
+        # (pondering on the opponent's clock), counted toward the budgets
+        self.credit = 0
+        self.soft = 0
+        self.hard = 0
+        self.hard_deadline = 0
+        self.best_move_changes = 0
+        self.scale = 1
+
+    def start_turn(self, time_remaining, move_number, phase):
+        # time_remaining is in nanoseconds, as the server reports it
+        self.start_time = default_timer()
+        self.credit = 0
+        remaining = time_remaining / 1000000000
+
+        if self.last_remaining is not None:
+            charged = self.last_remaining - remaining
+            overhead = charged - self.last_elapsed
+
+            # jump up to a slower round trip at once, but only slowly trust
+            # a faster one
+            if overhead >= 0:
+                self.rtt = max(overhead, self.rtt * 0.8 + overhead * 0.2)
+
+        self.last_remaining = remaining
+
+        # expect fewer moves to go both as the move number rises and as
+        # pieces come off the board
+        by_number = max(self.moves_to_go_min, self.moves_to_go_max - move_number / 2)
+        by_phase = self.moves_to_go_min + (self.moves_to_go_max - self.moves_to_go_min) * phase
+        moves_to_go = (by_number + by_phase) / 2
+
+        available = remaining - self.reserve - self.rtt_factor * self.rtt
+
+        # if we're nearly out, move as fast as we can while still moving
+        if available <= 0:
+            available = remaining * 0.1
+
+        self.hard = min(available / moves_to_go * self.hard_ratio, available * self.max_share)
+        self.soft = min(available / moves_to_go, self.hard)
+        self.hard_deadline = self.start_time + self.hard
+        self.best_move_changes = 0
+        self.scale = 1
+
+    def iteration_done(self, best_move_changed, fail_lows):
+        # whether to stop the search after this iteration, giving it more of
+        # the soft budget when the best move keeps changing or the score
+        # just dropped
+        self.best_move_changes = self.best_move_changes / 2 + best_move_changed
+        self.scale = 1 + self.instability * (self.best_move_changes + fail_lows)
+
+        return self.soft_exceeded()
+
+    def soft_exceeded(self):
+        # the next iteration takes at least as long as all the ones so far
+        elapsed = default_timer() - self.start_time + self.credit
+        return elapsed * 2 >= min(self.soft * self.scale, self.hard)
+
+    def end_turn(self):
+        self.last_elapsed = default_timer() - self.start_time
+
+    def elapsed(self):
+        return default_timer() - self.start_time
@@ -0,0 +1,188 @@
+from array import array
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # before Python 3.8, only the unshared table is available
+    SharedMemory = None
+
+# local imports
+from games.chess.constants import *
+
+# bound types (never 0, so a zero data word means an empty slot)
+LOWER = 1
+UPPER = 2
+EXACT = 3
+
+# scores are stored in fixed point, which is exact for the half point PST values
+SCORE_SCALE = 8
+
+# layout of the 64-bit data word of an entry
+MOVE_BITS = 28
+SCORE_BITS = 20
+SCORE_SHIFT = MOVE_BITS
+SCORE_OFFSET = 1 << (SCORE_BITS - 1)
+DEPTH_SHIFT = SCORE_SHIFT + SCORE_BITS
+BOUND_SHIFT = DEPTH_SHIFT + 8
+AGE_SHIFT = BOUND_SHIFT + 2
+
+MOVE_MASK = (1 << MOVE_BITS) - 1
+SCORE_MASK = (1 << SCORE_BITS) - 1
+AGE_MASK = 63
+
+# bytes per slot: 32 bits of key check plus the data word
+SLOT_SIZE = 12
+
+# slots looked at to estimate how full the table is
+HASHFULL_SAMPLE = 1000
+
+
+def fold(data):
+    # the data word folded to 32 bits, which the key check is stored XORed
+    # with, so a slot whose check and data were written by different
+    # processes at once doesn't match either key
+    return (data ^ (data >> 32)) & 0xFFFFFFFF
+
+
+class TranspositionTable:
+    # each bucket holds a depth-preferred slot followed by an always-replace
+    # slot. A shared table lives in shared memory, where other processes can
+    # attach to it by name and read and write it without locking
+
+    def __init__(self, size_mb=16, shared=False, name=None):
+        self.shm = None
+        self.owner = False
+
+        if name is not None:
+            self.shm = SharedMemory(name=name)
+            self.slots = self.shm.size // SLOT_SIZE
+            while self.slots & (self.slots - 1):
+                self.slots &= self.slots - 1
+        else:
+            buckets = 1
+
+            # largest power of two number of buckets that fits in the budget
+            while buckets * 4 * SLOT_SIZE <= size_mb * 1024 * 1024:
+                buckets *= 2
+
+            self.slots = buckets * 2
+
+            if shared:
+                if SharedMemory is None:
+                    raise RuntimeError("a shared transposition table needs Python 3.8 or later")
+
+                self.shm = SharedMemory(create=True, size=self.slots * SLOT_SIZE)
+                self.owner = True
+
+        self.mask = (self.slots >> 1) - 1
+        self.name = self.shm.name if self.shm is not None else None
+        self.clear()
+        self.age = 0
+
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+
+    def clear(self):
+        if self.shm is None:
+            self.checks = array('I', [0]) * self.slots
+            self.data = array('Q', [0]) * self.slots
+        else:
+            buf = self.shm.buf
+            self.checks = buf[:self.slots * 4].cast('I')
+            self.data = buf[self.slots * 4:self.slots * SLOT_SIZE].cast('Q')
+
+            # attaching processes keep what's already there
+            if self.owner:
+                buf[:self.slots * SLOT_SIZE] = bytes(self.slots * SLOT_SIZE)
+
+    def close(self):
+        # let go of the shared memory, freeing it if we created it
+        if self.shm is None:
+            return
+
+        self.checks.release()
+        self.data.release()
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+
+        self.shm = None
+
+    def new_search(self):
+        # entries from previous searches become preferred for replacement
+        self.age = (self.age + 1) & AGE_MASK
+
+    def probe(self, key, ply=0):
+        # ply is how far the position is from the root, to turn stored mate
+        # scores back into distances from the root
+        self.probes += 1
+
+        slot = (key & self.mask) << 1
+        check = key >> 32
+
+        for i in (slot, slot + 1):
+            data = self.data[i]
+
+            if data and self.checks[i] ^ fold(data) == check:
+                self.hits += 1
+                score = (((data >> SCORE_SHIFT) & SCORE_MASK) - SCORE_OFFSET) / SCORE_SCALE
+
+                if score >= MATE_BOUND:
+                    score -= ply
+                elif score <= -MATE_BOUND:
+                    score += ply
+
+                return ((data >> DEPTH_SHIFT) & 0xFF,
+                        (data >> BOUND_SHIFT) & 3,
+                        score,
+                        data & MOVE_MASK)
+
+        return None
+
+    def store(self, key, depth, bound, score, move=0, ply=0):
+        # only the part of the move that identifies it in the position is kept
+        move &= MOVE_KEY_MASK
+
+        # mate scores are stored as distances from this position rather than
+        # the root, so they stay right when it's reached at another ply
+        if score >= MATE_BOUND:
+            score += ply
+        elif score <= -MATE_BOUND:
+            score -= ply
+
+        slot = (key & self.mask) << 1
+        check = key >> 32
+        data = self.data[slot]
+        same = self.checks[slot] ^ fold(data) == check
+
+        # replace the depth-preferred slot if it's empty, the same position,
+        # stale, or not searched as deep, otherwise use the always-replace slot
+        if (data and not same and
+                (data >> AGE_SHIFT) == self.age and
+                ((data >> DEPTH_SHIFT) & 0xFF) > depth):
+            slot += 1
+            data = self.data[slot]
+            same = self.checks[slot] ^ fold(data) == check
+
+        if data and not same:
+            self.collisions += 1
+        elif data and not move:
+            # keep the old best move if we don't have a new one
+            move = data & MOVE_MASK
+
+        data = (move |
+                (int(score * SCORE_SCALE) + SCORE_OFFSET) << SCORE_SHIFT |
+                depth << DEPTH_SHIFT |
+                bound << BOUND_SHIFT |
+                self.age << AGE_SHIFT)
+
+        self.data[slot] = data
+        self.checks[slot] = check ^ fold(data)
+
+    def hashfull(self):
+        # permille of slots in use, from a sample of them
+        sample = min(HASHFULL_SAMPLE, self.slots)
+        return sum(1 for i in range(sample) if self.data[i]) * 1000 // sample
+
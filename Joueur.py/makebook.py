@@ -0,0 +1,301 @@
+# Builds a Polyglot opening book from PGN files. Games are streamed from the
+# files and replayed on the 0x88 board, in a process pool, and the moves
+# played from each position are counted in memory only up to a limit, past
+# which they're sorted into a run on disk and merged with the others at the
+# end, so collections of any size can be read.
+
+import argparse
+import heapq
+import re
+import struct
+import sys
+import tempfile
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from games.chess.constants import *
+from games.chess.engine import Chess
+from games.chess.book import ENTRY, polyglot_move
+
+# entries of the runs on disk: key and Polyglot move, then the games the
+# move was played in and the points it scored in them
+RUN_ENTRY = struct.Struct(">QHII")
+RUN_CHUNK = 4096
+
+# points for white and black in each result, two for a win and one for a
+# draw, as Polyglot weights moves
+RESULTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+HEADER = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+# comments, variation brackets and everything else separated by spaces
+TOKEN = re.compile(r"\{[^}]*\}|;[^\n]*|[()]|[^\s(){};]+")
+# move numbers need their dots, or castling and results written with zeros
+# would lose their first digit
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+SAN = re.compile(r"^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])=?([QRBN])?$")
+
+
+def read_games(path):
+    # yield the FEN the game starts from (None for the standard position),
+    # its result and its movetext for each game in a PGN file, a line at a
+    # time
+    headers = {}
+    movetext = []
+
+    with open(path, encoding="utf-8", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+
+            if line.startswith("[") and not movetext:
+                match = HEADER.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2)
+            elif line.startswith("["):
+                yield headers.get("FEN"), headers.get("Result"), "\n".join(movetext)
+                headers = {}
+                movetext = []
+
+                match = HEADER.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2)
+            elif line and not line.startswith("%"):
+                movetext.append(line)
+
+    if movetext:
+        yield headers.get("FEN"), headers.get("Result"), "\n".join(movetext)
+
+
+def san_moves(movetext):
+    # the moves of the main line, leaving out comments, variations, NAGs,
+    # move numbers and the result
+    variations = 0
+
+    for token in TOKEN.findall(movetext):
+        if token == "(":
+            variations += 1
+        elif token == ")":
+            variations -= 1
+        elif not variations and token[0] not in "{;$":
+            token = MOVE_NUMBER.sub("", token)
+
+            if token and token not in RESULTS and token != "*":
+                yield token
+
+
+def parse_san(game, san):
+    # the legal packed move a SAN move stands for, or 0 if there isn't one
+    san = san.rstrip("+#!?")
+
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        flag = KSIDE_CASTLE if len(san) == 3 else QSIDE_CASTLE
+
+        for move in game.generate_moves(single_square=game.get_san(game.kings[game.turn])):
+            if (move >> MOVE_FLAGS_SHIFT) & flag:
+                return move
+
+        return 0
+
+    match = SAN.match(san)
+    if not match:
+        return 0
+
+    piece, from_file, from_rank, to, promotion = match.groups()
+    piece = TYPE_CODES[(piece or PAWN).lower()]
+    promotion = TYPE_CODES[promotion.lower()] if promotion else 0
+
+    # a pawn that isn't capturing moves along its own file
+    if piece == PAWN_CODE and not from_file:
+        from_file = to[0]
+
+    # only generate the moves of our pieces of the type that could have
+    # made it, which is much faster than generating them all
+    for square in game.squares[game.turn]:
+        if game.board[square] & 7 != piece:
+            continue
+
+        m_from = game.get_san(square)
+        if (from_file and m_from[0] != from_file) or (from_rank and m_from[1] != from_rank):
+            continue
+
+        for move in game.generate_moves(single_square=m_from):
+            if ((move >> MOVE_PROMOTION_SHIFT) & 7 == promotion and
+                    game.get_san((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK) == to):
+                return move
+
+    return 0
+
+
+def count_moves(args):
+    # the games and positions read from a batch of games, and the games
+    # played and points scored by each move (by key and Polyglot move) in
+    # their first plies
+    games, depth = args
+    counts = {}
+    positions = 0
+
+    for fen, result, movetext in games:
+        points = RESULTS.get(result, (0, 0))
+        game = Chess(fen or DEFAULT_FEN)
+
+        for ply, san in enumerate(san_moves(movetext)):
+            if ply >= depth:
+                break
+
+            move = parse_san(game, san)
+
+            # a move we can't follow ends what we can use of the game
+            if not move:
+                break
+
+            key = (game.hash, polyglot_move(game, move))
+            count = counts.get(key)
+
+            if count is None:
+                count = counts[key] = [0, 0]
+
+            count[0] += 1
+            count[1] += points[0 if game.turn == WHITE else 1]
+            positions += 1
+            game.move(move)
+
+    return len(games), positions, counts
+
+
+def batches(paths, depth, size):
+    batch = []
+
+    for path in paths:
+        for game in read_games(path):
+            batch.append(game)
+
+            if len(batch) == size:
+                yield batch, depth
+                batch = []
+
+    if batch:
+        yield batch, depth
+
+
+def write_run(counts):
+    # the counts sorted into a temporary file, to be merged with the others
+    run = tempfile.TemporaryFile()
+
+    for (key, move), (games, points) in sorted(counts.items()):
+        run.write(RUN_ENTRY.pack(key, move, games, points))
+
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    while True:
+        chunk = run.read(RUN_ENTRY.size * RUN_CHUNK)
+
+        if not chunk:
+            break
+
+        yield from RUN_ENTRY.iter_unpack(chunk)
+
+    run.close()
+
+
+def write_book(output, entries, min_games):
+    # merge the sorted run entries into Polyglot entries, summing the counts
+    # for the same key and move, and return how many were written
+    written = 0
+
+    def flush(key, moves):
+        # weights have to fit in 16 bits, so the moves of a busy position
+        # are scaled down together
+        scale = max(max(points for _, _, points in moves) / 0xFFFF, 1)
+        moves.sort(key=lambda move: move[2], reverse=True)
+        kept = [move for move in moves if move[1] >= min_games]
+
+        for move, games, points in kept:
+            book.write(ENTRY.pack(key, move, int(points / scale) or (1 if points else 0), 0))
+
+        return len(kept)
+
+    with open(output, "wb") as book:
+        last_key = None
+        moves = []
+
+        for key, move, games, points in entries:
+            if key != last_key:
+                if moves:
+                    written += flush(last_key, moves)
+
+                last_key = key
+                moves = []
+
+            if moves and moves[-1][0] == move:
+                moves[-1][1] += games
+                moves[-1][2] += points
+            else:
+                moves.append([move, games, points])
+
+        if moves:
+            written += flush(last_key, moves)
+
+    return written
+
+
+def build(paths, output, depth, min_games, processes, batch_size, run_size):
+    start_time = default_timer()
+    games = 0
+    positions = 0
+    counts = {}
+    runs = []
+
+    pool = Pool(processes) if processes > 1 else None
+    tasks = batches(paths, depth, batch_size)
+    results = pool.imap_unordered(count_moves, tasks) if pool is not None else map(count_moves, tasks)
+
+    for batch_games, batch_positions, batch_counts in results:
+        games += batch_games
+        positions += batch_positions
+
+        for key, (played, points) in batch_counts.items():
+            count = counts.get(key)
+
+            if count is None:
+                counts[key] = [played, points]
+            else:
+                count[0] += played
+                count[1] += points
+
+        if len(counts) >= run_size:
+            runs.append(write_run(counts))
+            counts = {}
+
+        print("\r{} games, {:.0f} games/s".format(games, games / (default_timer() - start_time)),
+              end="", file=sys.stderr)
+
+    if pool is not None:
+        pool.close()
+
+    runs.append(write_run(counts))
+    read_time = default_timer() - start_time
+    print(file=sys.stderr)
+
+    entries = write_book(output, heapq.merge(*(read_run(run) for run in runs)), min_games)
+    duration = default_timer() - start_time
+
+    print("{} games ({} positions) read in {:.2f}s, {:.0f} games/s".format(
+        games, positions, read_time, games / max(read_time, 1e-9)))
+    print("{} entries from {} runs written to {} in {:.2f}s, {:.0f} games/s overall".format(
+        entries, len(runs), output, duration - read_time, games / max(duration, 1e-9)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds a Polyglot opening book from the moves played in PGN files.')
+    parser.add_argument('pgn', action='store', nargs='+', help='the PGN files to read')
+    parser.add_argument('-o', '--output', action='store', dest='output', default='book.bin', help='the book file to write')
+    parser.add_argument('-d', '--depth', action='store', dest='depth', type=int, default=30, help='how many plies into each game to take moves from')
+    parser.add_argument('-m', '--min-games', action='store', dest='min_games', type=int, default=1, help='how many games a move has to be played in to be kept')
+    parser.add_argument('-p', '--processes', action='store', dest='processes', type=int, default=cpu_count(), help='how many processes to replay the games in')
+    parser.add_argument('--batch', action='store', dest='batch', type=int, default=200, help='games per task given to a process')
+    parser.add_argument('--run-size', action='store', dest='run_size', type=int, default=500000, help='moves to count in memory before sorting them into a run on disk')
+    args = parser.parse_args()
+
+    build(args.pgn, args.output, args.depth, args.min_games, args.processes, args.batch, args.run_size)
@@ -0,0 +1,272 @@
+# Generates endgame tablebases of up to four pieces by retrograde analysis,
+# for the AI to probe with the tablebases setting. Each position is first
+# set up on the 0x88 board to find its legal moves (in a process pool), with
+# captures and promotions looked up in the smaller tables made before it,
+# and then the wins and losses are worked backwards from the checkmates one
+# ply at a time, by un-moving pieces from the positions just resolved.
+
+import argparse
+import os
+from array import array
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from games.chess.constants import *
+from games.chess.engine import Chess
+from games.chess.tablebase import Table, Tablebases, table_names, DRAW, ILLEGAL, TABLE_EXTENSION, MAX_PIECES
+
+# positions per task given to a process
+CHUNK_SIZE = 1 << 14
+
+
+def _to64(sq):
+    return (7 - (sq >> 4)) * 8 + (sq & 7)
+
+
+def _to88(sq):
+    return (7 - (sq >> 3)) * 16 + (sq & 7)
+
+# the engine's move tables by square numbered from a1 = 0, for un-moving
+# pieces without a board
+STEPS = {
+    KING: [[_to64(target) for target in KING_TARGETS[_to88(sq)]] for sq in range(64)],
+    KNIGHT: [[_to64(target) for target in KNIGHT_TARGETS[_to88(sq)]] for sq in range(64)]
+}
+RAYS = {type: [[[_to64(target) for target in ray] for ray in SLIDER_RAYS[type][_to88(sq)]] for sq in range(64)]
+        for type in (BISHOP, ROOK, QUEEN)}
+
+# each process keeps a board to set positions up on and the tables made
+# so far
+_game = None
+_tables = None
+
+
+def _init_worker(directory):
+    global _game, _tables
+    _game = Chess()
+    _tables = Tablebases(directory)
+
+
+def set_up(game, table, squares, turn):
+    # put a position on the board, returning whether it's legal
+    if len(set(squares)) < len(squares):
+        return False
+
+    game.board = bytearray(128)
+    game.squares = {WHITE: set(), BLACK: set()}
+
+    for (color, type), sq in zip(table.pieces, squares):
+        # pawns never stand on the first or last rank
+        if type == PAWN and sq >> 3 in (0, 7):
+            return False
+
+        game.place_piece(PIECE_CODES[color][type], _to88(sq))
+
+    game.turn = turn
+    game.castling = {WHITE: 0, BLACK: 0}
+    game.ep_square = EMPTY
+
+    # the side that just moved can't have left its king in check
+    return not game.king_attacked(WHITE if turn == BLACK else BLACK)
+
+
+def scan(args):
+    # a first look at a range of positions: which are illegal, how many
+    # distinct positions of this table their moves lead to, and the best
+    # and worst that captures and promotions out of it lead to, as wins in
+    # and losses in plies (each 0 if none), and whether any of them draw
+    name, start, stop = args
+    table = Table(name)
+    game = _game
+    size = stop - start
+    values = bytearray(size)
+    counts = bytearray(size)
+    wins = bytearray(size)
+    losses = bytearray(size)
+    draws = bytearray(size)
+
+    for i in range(size):
+        turn, squares = table.squares(start + i)
+
+        # symmetries of other positions are only looked up by their lowest
+        # index, so the others go unused
+        if table.index(squares, turn) != start + i or not set_up(game, table, squares, turn):
+            values[i] = ILLEGAL
+            continue
+
+        them = WHITE if turn == BLACK else BLACK
+        slots = {_to88(sq): slot for slot, sq in enumerate(squares)}
+        children = set()
+
+        # no moves is checkmate, a loss now, unless it's stalemate
+        moves = game.generate_moves()
+        if not moves and not game.in_check():
+            draws[i] = 1
+
+        for move in moves:
+            if move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK):
+                game.move(move)
+                value = _tables.probe(game)
+                game.undo()
+
+                if value is None:
+                    raise RuntimeError("{} needs the table for {}".format(name, game.generate_fen()))
+
+                if value == DRAW:
+                    draws[i] = 1
+                elif value & 1:
+                    # the opponent is mated in value - 1 plies
+                    if not wins[i] or value < wins[i]:
+                        wins[i] = value
+                elif value > losses[i]:
+                    losses[i] = value
+            else:
+                child = list(squares)
+                child[slots[move & MOVE_SQUARE_MASK]] = _to64((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK)
+                children.add(table.index(child, them))
+
+        counts[i] = len(children)
+
+    return start, values, counts, wins, losses, draws
+
+
+def unmoves(type, color, sq, occupied):
+    # the squares the piece on sq could have come from without capturing
+    if type == PAWN:
+        back = -8 if color == WHITE else 8
+        rank = sq >> 3 if color == WHITE else 7 - (sq >> 3)
+
+        if rank >= 2 and sq + back not in occupied:
+            yield sq + back
+
+            if rank == 3 and sq + 2 * back not in occupied:
+                yield sq + 2 * back
+    elif type in STEPS:
+        for target in STEPS[type][sq]:
+            if target not in occupied:
+                yield target
+    else:
+        for ray in RAYS[type][sq]:
+            for target in ray:
+                if target in occupied:
+                    break
+
+                yield target
+
+
+def predecessors(table, index):
+    # the distinct positions of the table with a move to this one
+    turn, squares = table.squares(index)
+    mover = WHITE if turn == BLACK else BLACK
+    occupied = set(squares)
+    found = set()
+
+    for slot, (color, type) in enumerate(table.pieces):
+        if color != mover:
+            continue
+
+        sq = squares[slot]
+
+        for target in unmoves(type, color, sq, occupied):
+            squares[slot] = target
+            found.add(table.index(squares, mover))
+
+        squares[slot] = sq
+
+    return found
+
+
+def generate(name, directory, processes):
+    table = Table(name)
+    total = table.size * 2
+    start_time = default_timer()
+
+    values = bytearray(total)
+    counts = bytearray(total)
+    wins = bytearray(total)
+    losses = bytearray(total)
+    draws = bytearray(total)
+
+    tasks = [(name, start, min(start + CHUNK_SIZE, total)) for start in range(0, total, CHUNK_SIZE)]
+
+    if processes > 1:
+        with Pool(processes, _init_worker, (directory,)) as pool:
+            results = list(pool.imap_unordered(scan, tasks))
+    else:
+        _init_worker(directory)
+        results = map(scan, tasks)
+
+    for start, *arrays in results:
+        stop = start + len(arrays[0])
+
+        for whole, part in zip((values, counts, wins, losses, draws), arrays):
+            whole[start:stop] = part
+
+    scan_time = default_timer() - start_time
+
+    # positions to resolve at each ply to mate: losses at even plies and
+    # wins at odd ones
+    levels = [array('L') for _ in range(ILLEGAL)]
+
+    for index in range(total):
+        if values[index] == ILLEGAL:
+            continue
+
+        if wins[index]:
+            levels[wins[index]].append(index)
+        elif not counts[index] and not draws[index]:
+            levels[losses[index]].append(index)
+
+    # a position lost in n plies makes every position with a move to it a
+    # win in n + 1, and a position won in n takes one more way out from
+    # every position with a move to it, which is lost in n + 1 (or more, if
+    # another move held out longer) once there are none left
+    for level in range(ILLEGAL - 1):
+        for index in levels[level]:
+            if values[index]:
+                continue
+
+            values[index] = level + 1
+
+            for parent in predecessors(table, index):
+                if values[parent]:
+                    continue
+
+                if not level & 1:
+                    levels[level + 1].append(parent)
+                else:
+                    counts[parent] -= 1
+
+                    if losses[parent] < level + 1:
+                        losses[parent] = level + 1
+
+                    if not counts[parent] and not wins[parent] and not draws[parent]:
+                        levels[losses[parent]].append(parent)
+
+        levels[level] = None
+
+    with open(os.path.join(directory, name + TABLE_EXTENSION), "wb") as file:
+        file.write(values)
+
+    # positions left unresolved are draws
+    legal = total - values.count(ILLEGAL)
+    decisive = legal - values.count(DRAW)
+    longest = max((value for value in values if value != ILLEGAL), default=0)
+    duration = default_timer() - start_time
+
+    print("{:<8} {:>9} positions, {:>5.1f}% decisive, longest mate {:>3} plies, {:.2f}s ({:.2f}s scanning)".format(
+        name, legal, decisive * 100 / max(legal, 1), max(longest - 1, 0), duration, scan_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates endgame tablebases by retrograde analysis.')
+    parser.add_argument('tables', action='store', nargs='*', help='the tables to generate, e.g. KRvK (all of up to --pieces pieces by default, which the ones given need the smaller of anyway)')
+    parser.add_argument('-o', '--output', action='store', dest='output', default='tablebases', help='the directory to write the tables to')
+    parser.add_argument('-n', '--pieces', action='store', dest='pieces', type=int, default=MAX_PIECES, choices=(3, 4), help='the most pieces (kings included) to generate tables for')
+    parser.add_argument('-p', '--processes', action='store', dest='processes', type=int, default=cpu_count(), help='how many processes to set positions up in')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+
+    for name in args.tables or table_names(args.pieces):
+        generate(name, args.output, args.processes)
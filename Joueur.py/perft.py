@@ -0,0 +1,210 @@
+# Counts the positions reachable from a FEN at a given depth, to check the
+# move generators in games/chess against known counts and to time them.
+
+import argparse
+import sys
+from array import array
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from games.chess.constants import DEFAULT_FEN
+from games.chess.engine import Chess
+from games.chess.bitboard import BitboardChess
+
+BACKENDS = {"0x88": Chess, "bitboard": BitboardChess}
+
+# reference positions with their known node counts at depths 1, 2, ...
+SUITE = [
+    ("startpos", DEFAULT_FEN,
+        [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594]),
+    ("en passant exposes king", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+        [18, 92, 1670, 10138, 185429, 1134888]),
+    ("en passant exposes king 2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+        [13, 102, 1266, 10276, 135655, 1015133]),
+    ("en passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+        [15, 126, 1928, 13931, 206379, 1440467]),
+    ("kingside castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+        [15, 66, 1198, 6399, 120330, 661072]),
+    ("queenside castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+        [16, 71, 1286, 7418, 141077, 803711]),
+    ("castling rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+        [26, 1141, 27826, 1274206]),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+        [44, 1494, 50509, 1720476]),
+    ("promotion out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+        [11, 133, 1442, 19174, 266199, 3821001]),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+        [29, 165, 5160, 31961, 1004658]),
+    ("promotion gives check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+        [9, 40, 472, 2661, 38983, 217342]),
+    ("underpromotion gives check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+        [6, 27, 273, 1329, 18135, 92683]),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+        [2, 6, 13, 63, 382, 2217]),
+    ("stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+        [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("stalemate and checkmate 2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+        [37, 183, 6559, 23527]),
+]
+
+# bytes per entry of the perft table: key, node count and depth
+ENTRY_SIZE = 17
+
+
+class PerftTable:
+    # always-replace table of subtree node counts, for hashed perft
+
+    def __init__(self, size_mb):
+        entries = 1
+
+        # largest power of two number of entries that fits in the budget
+        while entries * 2 * ENTRY_SIZE <= size_mb * 1024 * 1024:
+            entries *= 2
+
+        self.mask = entries - 1
+        self.keys = array('Q', [0]) * entries
+        self.nodes = array('Q', [0]) * entries
+        self.depths = array('B', [0]) * entries
+
+    def probe(self, key, depth):
+        i = key & self.mask
+
+        if self.keys[i] == key and self.depths[i] == depth:
+            return self.nodes[i]
+
+        return None
+
+    def store(self, key, depth, nodes):
+        i = key & self.mask
+        self.keys[i] = key
+        self.nodes[i] = nodes
+        self.depths[i] = depth
+
+
+def perft(game, depth, table=None):
+    if depth == 0:
+        return 1
+
+    # the leaves don't need to be made, only counted
+    if depth == 1:
+        return len(game.generate_moves())
+
+    if table is not None:
+        nodes = table.probe(game.hash, depth)
+
+        if nodes is not None:
+            return nodes
+
+    nodes = 0
+    for move in game.generate_moves():
+        game.move(move)
+        nodes += perft(game, depth - 1, table)
+        game.undo()
+
+    if table is not None:
+        table.store(game.hash, depth, nodes)
+
+    return nodes
+
+
+# each worker process keeps its own table across the root moves it's given
+_table = None
+
+
+def _init_worker(hash_mb):
+    global _table
+    _table = PerftTable(hash_mb) if hash_mb else None
+
+
+def _perft_move(args):
+    backend, fen, move, depth = args
+    game = BACKENDS[backend](fen)
+    game.move(move)
+
+    return perft(game, depth - 1, _table)
+
+
+def move_name(game, move):
+    # long algebraic notation, e.g. e2e4 or e7e8q
+    view = game.get_move(move)
+    return game.get_san(view.m_from) + game.get_san(view.m_to) + view.promotion
+
+
+def divide(backend, fen, depth, processes=1, hash_mb=0):
+    # node counts below each root move, spread over a pool of processes
+    game = BACKENDS[backend](fen)
+    moves = game.generate_moves()
+    tasks = [(backend, fen, move, depth) for move in moves]
+
+    if processes > 1 and depth > 1:
+        with Pool(processes, _init_worker, (hash_mb,)) as pool:
+            counts = pool.map(_perft_move, tasks, chunksize=1)
+    else:
+        _init_worker(hash_mb)
+        counts = [_perft_move(task) for task in tasks]
+
+    return [(move_name(game, move), nodes) for move, nodes in zip(moves, counts)]
+
+
+def run_suite(backend, depth, processes, hash_mb):
+    failed = 0
+    total = 0
+    start_time = default_timer()
+
+    for name, fen, counts in SUITE:
+        d = min(depth, len(counts))
+        nodes = sum(count for _, count in divide(backend, fen, d, processes, hash_mb))
+        total += nodes
+
+        if nodes != counts[d-1]:
+            failed += 1
+
+        print("{:<32} depth {} {:>10} {}".format(
+            name, d, nodes, "ok" if nodes == counts[d-1] else "FAILED (expected {})".format(counts[d-1])))
+
+    duration = default_timer() - start_time
+    print("{} of {} positions passed, {} nodes in {:.2f}s ({:.0f} nps)".format(
+        len(SUITE) - failed, len(SUITE), total, duration, total / max(duration, 1e-9)))
+
+    return not failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Counts the leaf nodes of the move tree from a position to check and time the move generator.')
+    parser.add_argument('fen', action='store', nargs='?', default=DEFAULT_FEN, help='the position to count from (the starting position by default)')
+    parser.add_argument('-d', '--depth', action='store', dest='depth', type=int, default=4, help='the number of plies to count to (the most the suite goes to with --suite)')
+    parser.add_argument('-b', '--backend', action='store', dest='backend', choices=BACKENDS, default='0x88', help='the board representation to use')
+    parser.add_argument('--divide', action='store_true', dest='divide', help='print the node count below each root move')
+    parser.add_argument('--hash', action='store', dest='hash_mb', type=int, default=0, help='MB per process for a table of subtree counts, to skip transpositions')
+    parser.add_argument('-j', '--processes', action='store', dest='processes', type=int, default=cpu_count(), help='the number of processes to spread the root moves over')
+    parser.add_argument('--suite', action='store_true', dest='suite', help='check the built-in reference positions instead of a single FEN')
+    args = parser.parse_args()
+
+    if args.depth < 1:
+        parser.error('the depth must be at least 1')
+
+    if args.suite:
+        sys.exit(0 if run_suite(args.backend, args.depth, args.processes, args.hash_mb) else 1)
+
+    start_time = default_timer()
+    counts = divide(args.backend, args.fen, args.depth, args.processes, args.hash_mb)
+    duration = default_timer() - start_time
+
+    if args.divide:
+        for name, nodes in sorted(counts):
+            print("{}: {}".format(name, nodes))
+        print()
+
+    nodes = sum(count for _, count in counts)
+    print("Nodes: {}".format(nodes))
+    print("Time: {:.3f}s ({:.0f} nps)".format(duration, nodes / max(duration, 1e-9)))
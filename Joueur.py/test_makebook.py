@@ -0,0 +1,60 @@
+# Checks that makebook.py follows games to the end, castling written with
+# zeros and results included, and writes an entry for every move.
+# Run with: python3 -m unittest test_makebook
+
+import os
+import tempfile
+import unittest
+
+from games.chess.book import OpeningBook
+from makebook import build, count_moves, read_games, san_moves
+
+PGN = """[Event "Zeros"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. 0-0 Nf6 1-0
+
+[Event "Long castling"]
+[Result "1/2-1/2"]
+
+1.d4 d5 2.Nc3 Nc6 3.Bf4 Bf5 4.Qd2 Qd7 5.0-0-0 5...0-0-0 6. e3 e6 1/2-1/2
+"""
+
+
+class MakeBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pgn = os.path.join(self.directory.name, "games.pgn")
+
+        with open(self.pgn, "w") as file:
+            file.write(PGN)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_san_moves(self):
+        games = list(read_games(self.pgn))
+
+        self.assertEqual(list(san_moves(games[0][2])),
+                         ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5", "0-0", "Nf6"])
+        self.assertEqual(list(san_moves(games[1][2])),
+                         ["d4", "d5", "Nc3", "Nc6", "Bf4", "Bf5", "Qd2", "Qd7", "0-0-0", "0-0-0", "e3", "e6"])
+
+    def test_build(self):
+        games, positions, counts = count_moves((list(read_games(self.pgn)), 30))
+
+        self.assertEqual(games, 2)
+        self.assertEqual(positions, 20)
+
+        output = os.path.join(self.directory.name, "book.bin")
+        build([self.pgn], output, 30, 1, 1, 200, 500000)
+        book = OpeningBook(output)
+
+        # every ply of both games is a different position and move
+        self.assertEqual(book.size, 20)
+        book.close()
+
+
+if __name__ == '__main__':
+    unittest.main()